@@ -44,6 +44,10 @@ LAUNCHCTL_PATH = "/bin/launchctl"
 SCRIPT_NAME = "texliveupdatecheck"
 PLIST_NAME = "com.googlecode.mactlmgr.update_check.plist"
 
+# modules the update checker imports, copied from the directory this script
+# is in (the app's Resources) to the directory the script is installed in
+SUPPORT_MODULES = ("parse_tlpdb.py",)
+
 def log_message(msg):
     """write a message to standard output"""
     sys.stderr.write("%s: %s\n" % (os.path.basename(sys.argv[0]), msg))
@@ -182,8 +186,33 @@ def install_script(source_path):
             log_message("ERROR: failed to copy %s --> %s" % (source_path, script_path))
             ret = 1
             
+    if ret == 0:
+        ret = install_support_modules()
+            
     return ret    
 
+def install_support_modules():
+    """copies SUPPORT_MODULES next to the installed script; returns nonzero on failure"""
+    
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    script_dir = os.path.dirname(installed_script_path())
+    ret = 0
+    
+    for module_name in SUPPORT_MODULES:
+        source_path = os.path.join(source_dir, module_name)
+        module_path = os.path.join(script_dir, module_name)
+        # the update checker falls back to tlmgr without it
+        if os.path.exists(source_path) == False:
+            log_message("no %s to install" % (source_path))
+            continue
+        try:
+            copyfile(source_path, module_path)
+        except Exception as e:
+            log_message("ERROR: failed to copy %s --> %s" % (source_path, module_path))
+            ret = 1
+            
+    return ret
+
 if __name__ == '__main__':
         
     parser = OptionParser()
@@ -8,6 +8,7 @@
 
 PLIST_PATH="/Library/LaunchAgents/com.googlecode.mactlmgr.update_check.plist"
 SCRIPT_PATH="/Library/Application Support/TeX Live Utility/update_check.py"
+PARSER_PATH="/Library/Application Support/TeX Live Utility/parse_tlpdb.py"
 
 if [ -f "$PLIST_PATH" ]; then
     if /bin/launchctl unload -w -S Aqua "$PLIST_PATH" ; then
@@ -35,3 +36,11 @@ else
     echo "no file at $SCRIPT_PATH" >&2
 fi
 
+if [ -f "$PARSER_PATH" ]; then
+    if rm "$PARSER_PATH" ; then
+        echo "removed $PARSER_PATH" >&2
+    else
+        echo "failed to remove $PARSER_PATH" >&2
+    fi
+fi
+
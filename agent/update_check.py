@@ -43,13 +43,13 @@ _ALERT_TIMEOUT = 3600 * 12
 
 # public attribute; can be checked from the shell with something like
 # python -B -c 'import sys; sys.path.append("/Library/Application Support/TeX Live Utility"); import update_check as uc; sys.stdout.write("%s\n" % (uc.VERSION))'
-VERSION = 0.3
+VERSION = 0.5
 
 def log_message(msg):
     """Writes to standard error, prepending the calling program name."""
     sys.stderr.write("%s: %s\n" % (os.path.basename(sys.argv[0]), msg))
 
-def check_for_updates(tlmgr_path, repository=None):
+def tlmgr_check_for_updates(tlmgr_path, repository=None):
     """Check for updates using TeX Live Manager.
     
     Arguments:
@@ -106,6 +106,181 @@ def check_for_updates(tlmgr_path, repository=None):
     
     return count, actual_repository
     
+# what tlmgr means by the "ctan" repository
+_CTAN_REPOSITORY = "https://mirror.ctan.org/systems/texlive/tlnet"
+
+# seconds to wait for the mirror before giving up and letting tlmgr try
+_DOWNLOAD_TIMEOUT = 60
+
+def _import_parse_tlpdb():
+    """Imports parse_tlpdb, looking next to this script and in its parent directory if needed.
+    
+    agent_installer copies parse_tlpdb.py next to the installed script; the
+    parent directory is for running this from a source checkout.
+    
+    """
+    try:
+        import parse_tlpdb
+    except ImportError:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        for directory in (script_dir, os.path.dirname(script_dir)):
+            if os.path.exists(os.path.join(directory, "parse_tlpdb.py")) and directory not in sys.path:
+                sys.path.append(directory)
+        import parse_tlpdb
+    return parse_tlpdb
+    
+def local_tlpdb_path(tlmgr_path):
+    """Returns the path of the texlive.tlpdb for the installation tlmgr_path belongs to.
+    
+    Arguments:
+    tlmgr_path -- absolute path to tlmgr executable, e.g., /Library/TeX/texbin/tlmgr
+    
+    Discussion:
+    texbin is normally a symlink to bin/<arch> of the installation, so the
+    installation is two levels above the resolved bin directory.  A tlmgr
+    symlinked on its own resolves to texmf-dist/scripts/texlive/tlmgr.pl,
+    three levels below the installation.
+    
+    """
+    
+    bin_dir = os.path.realpath(os.path.dirname(tlmgr_path))
+    script_dir = os.path.dirname(os.path.realpath(tlmgr_path))
+    candidates = (os.path.dirname(os.path.dirname(bin_dir)), os.path.dirname(os.path.dirname(os.path.dirname(script_dir))))
+    for texmf_root in candidates:
+        tlpdb_path = os.path.join(texmf_root, "tlpkg", "texlive.tlpdb")
+        if os.path.exists(tlpdb_path):
+            return tlpdb_path
+    raise IOError("no texlive.tlpdb found for %s" % (tlmgr_path))
+    
+def _open_remote_tlpdb(repository):
+    """Opens the tlpdb of repository for reading.
+    
+    Arguments:
+    repository -- a URL or a local directory, as tlmgr accepts
+    
+    Returns:
+    Two-tuple with a file that parse_tlpdb can read and the repository actually
+    used, which differs from the argument if the server redirected.
+    
+    """
+    
+    suffix = "/tlpkg/texlive.tlpdb.xz"
+    if repository.startswith("file://"):
+        repository = repository[len("file://"):]
+    if "://" not in repository:
+        for name in ("texlive.tlpdb.xz", "texlive.tlpdb"):
+            path = os.path.join(repository, "tlpkg", name)
+            if os.path.exists(path):
+                return open(path, "rb"), repository
+        raise IOError("no tlpdb in %s" % (repository))
+        
+    try:
+        from urllib.request import urlopen
+    except ImportError:
+        from urllib2 import urlopen
+    import io
+    
+    response = urlopen(repository.rstrip("/") + suffix, timeout=_DOWNLOAD_TIMEOUT)
+    actual_url = response.geturl()
+    actual_repository = actual_url[:-len(suffix)] if actual_url.endswith(suffix) else repository
+    # the xz data is decompressed as it arrives, which needs a buffered stream
+    if not hasattr(response, "peek"):
+        response = io.BufferedReader(response)
+    return response, actual_repository
+    
+def native_check_for_updates(tlmgr_path, repository=None):
+    """Check for updates by comparing the local and remote tlpdb directly.
+    
+    Arguments:
+    tlmgr_path -- absolute path to tlmgr executable
+    repository -- optional URL to use instead of the installation's default
+    
+    Returns:
+    Two-tuple with number of available updates and the actual repository used.
+    
+    Discussion:
+    Counts what tlmgr update --list reports as updates and additions, without
+    starting tlmgr.  An update is an installed package with a higher revision
+    in the repository.  An addition is a package that the repository version of
+    an installed collection depends on, that is not installed and that the
+    installed version of the collection didn't depend on; the latter are
+    packages the user removed, which tlmgr doesn't reinstall.  Only the local
+    platforms are considered, as with tlmgr.
+    
+    Raises an exception if either database can't be read, or if the
+    installation uses several repositories; check_for_updates then falls back
+    to tlmgr.
+    
+    """
+    
+    assert os.path.isabs(tlmgr_path), "tlmgr_path must be absolute"
+    parse_tlpdb = _import_parse_tlpdb()
+    
+    local_path = local_tlpdb_path(tlmgr_path)
+    with parse_tlpdb.open_tlpdb(local_path) as local_tlpdb:
+        header = parse_tlpdb.header_from_tlpdb(local_tlpdb)
+    archs = header.get("settings", {}).get("available_architectures", "").split()
+    
+    if not repository:
+        repository = header.get("options", {}).get("location", "ctan")
+    if repository == "ctan":
+        repository = _CTAN_REPOSITORY
+    # tagged repositories need tlmgr's pinning logic
+    assert len(repository.split()) == 1 and "#" not in repository, "multiple repositories in %s" % (repository)
+    
+    fields = ("category", "revision", "depends")
+    with parse_tlpdb.open_tlpdb(local_path) as local_tlpdb:
+        local = parse_tlpdb.TLDatabase.from_tlpdb(local_tlpdb, archs=archs or None, fields=fields)
+    
+    log_message("reading tlpdb from %s" % (repository))
+    remote_tlpdb, actual_repository = _open_remote_tlpdb(repository)
+    try:
+        remote = parse_tlpdb.TLDatabase.from_tlpdb(remote_tlpdb, archs=archs or None, fields=fields)
+    finally:
+        remote_tlpdb.close()
+    
+    count = 0
+    for package in local:
+        if package.name.startswith("00texlive."):
+            continue
+        remote_package = remote.get(package.name)
+        if remote_package is not None and remote_package.revision > package.revision:
+            count += 1
+            
+    added = set()
+    for collection in local.packages_in_category("Collection"):
+        remote_collection = remote.get(collection.name)
+        if remote_collection is None:
+            continue
+        for name in set(remote_collection.depends).difference(collection.depends):
+            if name not in local and name in remote:
+                added.add(name)
+    count += len(added)
+    
+    return count, actual_repository
+    
+def check_for_updates(tlmgr_path, repository=None):
+    """Check for updates, without starting tlmgr if possible.
+    
+    Arguments:
+    tlmgr_path -- absolute path to tlmgr executable
+    repository -- optional URL to be passed as the --repository argument to tlmgr
+    
+    Returns:
+    Two-tuple with number of available updates and the actual repository used.
+    
+    Discussion:
+    Uses native_check_for_updates, and tlmgr_check_for_updates if that fails,
+    e.g., because parse_tlpdb isn't installed alongside this script.
+    
+    """
+    
+    try:
+        return native_check_for_updates(tlmgr_path, repository=repository)
+    except Exception as e:
+        log_message("unable to compare tlpdb files (%s); using tlmgr" % (e))
+    return tlmgr_check_for_updates(tlmgr_path, repository=repository)
+    
 def macosx_update_check():
     """Check for updates on Mac OS X.  Returns zero on success.
     
@@ -0,0 +1,735 @@
+#!/usr/bin/env python
+
+#
+# This software is Copyright (c) 2010-2016
+# Adam Maxwell. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# - Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# - Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in
+# the documentation and/or other materials provided with the
+# distribution.
+#
+# - Neither the name of Adam Maxwell nor the names of any
+# contributors may be used to endorse or promote products derived
+# from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# Benchmark for parse_tlpdb.py.  Generates a synthetic texlive.tlpdb of
+# whatever size you ask for, times each phase of the parse_tlpdb pipeline
+# separately, and writes the results as JSON so runs from different commits
+# can be compared:
+#
+#   $ ./benchmark_tlpdb.py --packages 6000 -o before.json
+#   $ git checkout my-branch
+#   $ ./benchmark_tlpdb.py --packages 6000 -o after.json --compare before.json
+#
+# The 2016 tlpdb took 1.76 seconds to parse and write as a plist (see the
+# note in -[TLMDatabase reloadDatabaseFromPropertyListAtPath:]), and the
+# current one is a lot bigger than that.
+
+import sys, os
+import json
+import random
+import tempfile
+from time import time
+
+try:
+    from time import perf_counter as _timer
+except ImportError:
+    _timer = time
+try:
+    from time import process_time as _cpu_timer
+except ImportError:
+    from time import clock as _cpu_timer
+
+# make sure we benchmark the parse_tlpdb.py next to this file, not some
+# other copy that happens to be on sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import parse_tlpdb
+import tlpdb_depgraph
+
+DEFAULT_ARCHS = ("aarch64-linux", "amd64-freebsd", "amd64-netbsd", "armhf-linux", "i386-freebsd",
+                 "i386-linux", "i386-netbsd", "i386-solaris", "universal-darwin", "windows",
+                 "x86_64-cygwin", "x86_64-darwinlegacy", "x86_64-linux", "x86_64-linuxmusl", "x86_64-solaris")
+
+_CATEGORIES = ("Package", "Package", "Package", "Package", "ConTeXt", "TLCore")
+_LANGUAGES = ("de", "en", "fr", "ja", "ru")
+_DOC_DETAILS = ("Readme", "Package documentation", "Example of use", "Quick start", "Change log")
+_WORDS = ("the", "package", "provides", "macros", "for", "typesetting", "with", "LaTeX", "fonts",
+          "support", "document", "class", "and", "a", "of", "in", "to", "style", "files", "option")
+
+def _sentence(rng, count):
+    return " ".join(rng.choice(_WORDS) for i in range(count))
+
+def write_synthetic_tlpdb(output, packages=5000, runfiles=20, srcfiles=2, docfiles=6,
+                          binfiles=3, binary_fraction=0.05, archs=DEFAULT_ARCHS,
+                          longdesc_lines=4, collections=40, mirror=None, seed=0):
+    """Write a synthetic tlpdb to a file-like object.
+
+    Arguments:
+    output -- a file-like object, open for writing text
+    packages -- number of ordinary packages
+    runfiles -- runfiles per package
+    srcfiles -- srcfiles per package
+    docfiles -- docfiles per package; some of them get details= and language= attributes
+    binfiles -- binfiles per architecture, for packages that have binaries
+    binary_fraction -- fraction of packages that have per-architecture binaries
+    archs -- sequence of architecture names
+    longdesc_lines -- number of longdesc lines per package
+    collections -- number of collection-* packages; these depend on the ordinary packages,
+    and are in turn depended on by scheme-full
+    mirror -- if not None, written as a location-url line, as tlmgr dump-tlpdb does
+    seed -- seed for the random number generator, so output is reproducible
+
+    Returns:
+    The number of lines written.
+
+    The layout follows a real tlpdb: the 00texlive.* records come first, followed
+    by ordinary packages, per-architecture binary packages, collections and schemes.
+
+    """
+
+    rng = random.Random(seed)
+    lines = []
+
+    def record(rec):
+        lines.extend(rec)
+        lines.append("")
+
+    if mirror:
+        lines.append("location-url\t%s" % (mirror))
+
+    record(["name 00texlive.config",
+            "category TLCore",
+            "shortdesc TeX Live network archive option settings",
+            "longdesc This package contains configuration options for the TeX Live",
+            "longdesc archive. If container_split_{doc,src}_files occurs in a depend",
+            "longdesc line this is set to 1, otherwise it is 0.",
+            "depend container_format/xz",
+            "depend container_split_doc_files/1",
+            "depend container_split_src_files/1",
+            "depend frozen/0",
+            "depend minrelease/2016",
+            "depend release/2026",
+            "depend revision/%d" % (70000 + packages)])
+
+    record(["name 00texlive.installation",
+            "category TLCore",
+            "depend opt_autobackup:1",
+            "depend opt_backupdir:tlpkg/backups",
+            "depend opt_create_formats:1",
+            "depend opt_desktop_integration:0",
+            "depend opt_file_assocs:1",
+            "depend opt_generate_updmap:0",
+            "depend opt_install_docfiles:1",
+            "depend opt_install_srcfiles:1",
+            "depend opt_location:http://mirror.ctan.org/systems/texlive/tlnet",
+            "depend opt_path:0",
+            "depend opt_post_code:1",
+            "depend opt_sys_bin:/usr/local/bin",
+            "depend opt_sys_info:/usr/local/share/info",
+            "depend opt_sys_man:/usr/local/share/man",
+            "depend opt_w32_multi_user:1",
+            "depend setting_available_architectures:%s" % (" ".join(archs)),
+            "depend setting_platform:%s" % (archs[-1] if archs else "x86_64-linux")])
+
+    names = []
+    binary_names = []
+    for pkg_idx in range(packages):
+
+        name = "pkg%05d" % (pkg_idx)
+        names.append(name)
+        has_binaries = archs and rng.random() < binary_fraction
+
+        rec = ["name %s" % (name),
+               "category %s" % (rng.choice(_CATEGORIES)),
+               "revision %d" % (rng.randint(1000, 70000)),
+               "shortdesc %s" % (_sentence(rng, 6))]
+        for i in range(longdesc_lines):
+            rec.append("longdesc %s" % (_sentence(rng, 12)))
+        rec.append("containersize %d" % (rng.randint(1000, 100000)))
+        rec.append("containerchecksum %064x" % (rng.getrandbits(256)))
+
+        if has_binaries:
+            binary_names.append(name)
+            rec.append("depend %s.ARCH" % (name))
+        if pkg_idx % 7 == 0:
+            rec.append("execute AddFormat name=%s engine=pdftex options=\"-translate-file=cp227.tcx *%s.ini\"" % (name, name))
+        if pkg_idx % 11 == 0:
+            rec.append("postaction shortcut type=menu name=\"%s\" cmd=TEXDIR/bin/windows/%s.exe" % (name, name))
+        if pkg_idx % 50 == 0:
+            rec.append("relocated 1")
+
+        if docfiles:
+            rec.append("docfiles size=%d" % (rng.randint(10, 5000)))
+            for i in range(docfiles):
+                path = " RELOC/doc/latex/%s/%s-doc%d.pdf" % (name, name, i)
+                if i == 0:
+                    rec.append(path + " details=\"%s\"" % (rng.choice(_DOC_DETAILS)))
+                elif i == 1:
+                    rec.append(path + " details=\"%s\" language=\"%s\"" % (rng.choice(_DOC_DETAILS), rng.choice(_LANGUAGES)))
+                else:
+                    rec.append(path)
+
+        if srcfiles:
+            rec.append("srcfiles size=%d" % (rng.randint(1, 500)))
+            for i in range(srcfiles):
+                rec.append(" RELOC/source/latex/%s/%s%d.dtx" % (name, name, i))
+
+        if runfiles:
+            rec.append("runfiles size=%d" % (rng.randint(1, 500)))
+            for i in range(runfiles):
+                ext = ("sty", "cls", "tex", "def", "cfg")[i % 5]
+                rec.append(" RELOC/tex/latex/%s/%s%d.%s" % (name, name, i, ext))
+
+        rec.append("catalogue-ctan /macros/latex/contrib/%s" % (name))
+        rec.append("catalogue-license lppl1.3c")
+        rec.append("catalogue-topics %s" % (_sentence(rng, 2)))
+        rec.append("catalogue-version %d.%d" % (rng.randint(0, 9), rng.randint(0, 99)))
+        record(rec)
+
+    for name in binary_names:
+        for arch in archs:
+            rec = ["name %s.%s" % (name, arch),
+                   "category Package",
+                   "revision %d" % (rng.randint(1000, 70000)),
+                   "shortdesc %s for %s" % (name, arch),
+                   "containersize %d" % (rng.randint(1000, 100000)),
+                   "binfiles arch=%s size=%d" % (arch, rng.randint(1, 500))]
+            for i in range(binfiles):
+                rec.append(" bin/%s/%s%d" % (arch, name, i))
+            record(rec)
+
+    collection_names = ["collection-synthetic%03d" % (i) for i in range(collections)]
+    for coll_idx, coll_name in enumerate(collection_names):
+        rec = ["name %s" % (coll_name),
+               "category Collection",
+               "revision %d" % (rng.randint(1000, 70000)),
+               "shortdesc Synthetic collection %d" % (coll_idx)]
+        # a collection depending on its predecessor mirrors the real
+        # collection-latexextra -> collection-latexrecommended chains
+        if coll_idx > 0:
+            rec.append("depend %s" % (collection_names[coll_idx - 1]))
+        for name in names[coll_idx::max(collections, 1)]:
+            rec.append("depend %s" % (name))
+        record(rec)
+
+    record(["name scheme-full",
+            "category Scheme",
+            "revision %d" % (rng.randint(1000, 70000)),
+            "shortdesc full scheme (everything)"] + ["depend %s" % (c) for c in collection_names])
+
+    for line in lines:
+        output.write(line)
+        output.write("\n")
+    return len(lines)
+
+def _reference_attributes_from_line(line):
+    """The original character-at-a-time attribute parser from parse_tlpdb.py.
+    
+    Kept as a reference for verify_attribute_parser(); don't use it for anything else.
+    
+    """
+    
+    key = None
+    value = None
+    chars = []
+    quote_count = 0
+    attrs = {}
+    for c in line:
+
+        if c == "=":
+            
+            if key == None:
+                assert quote_count == 0, "possibly quoted key in line %s" % (line)
+                key = "".join(chars)
+                chars = []
+            else:
+                chars.append(c)
+        
+        elif c == "\"":
+            
+            quote_count += 1
+            
+        elif c == " ":
+            
+            # if quotes are matched, we've reached the end of a key-value pair
+            if quote_count % 2 == 0:
+                assert key != None, "no key found for %s" % (line)
+                assert key not in attrs, "key already assigned for line %s" % (line)
+                attrs[key] = "".join(chars)
+                
+                # reset parser state
+                chars = []
+                key = None
+                quote_count = 0
+            else:
+                chars.append(c)
+                
+        else:
+            chars.append(c)
+    
+    assert key != None, "no key found for %s" % (line)
+    assert len(chars), "no values found for line %s" % (line)
+    attrs[key] = "".join(chars)
+    return attrs
+
+# attribute lines from real tlpdbs, including the broken pythontex one
+_ATTRIBUTE_SAMPLES = ("size=1", "arch=x86_64-darwin size=1", "details=\"Package introduction\" language=\"de\"",
+                      "details=\"Readme\" language=\"ja\"", "details=\"\"Quick start\" documentation\"",
+                      "details=\"a=b c\" language=\"en\"", "size=", "arch=x86_64-linux  size=1", "size=1 ",
+                      "\"size\"=1", "size=1 size=2", "size=1 size=2 arch=x")
+
+def verify_attribute_parser(iterations=200000, seed=0):
+    """Differential test of parse_tlpdb._attributes_from_line against the original parser.
+    
+    Runs the samples above and random strings built from the characters that matter
+    to the tokenizer.  Both parsers must return the same dictionary or raise an
+    AssertionError with the same message.  Returns a list of mismatched inputs.
+    
+    """
+    
+    def outcome(func, line):
+        try:
+            return func(line)
+        except AssertionError as e:
+            return ("AssertionError", str(e))
+            
+    rng = random.Random(seed)
+    tokens = ("a", "b", "=", "\"", " ", "x", "size=1", "\t", "details=", "\"Readme\"")
+    lines = list(_ATTRIBUTE_SAMPLES)
+    for i in range(iterations):
+        lines.append("".join(rng.choice(tokens) for j in range(rng.randint(0, 12))))
+        
+    mismatches = []
+    for line in lines:
+        if outcome(parse_tlpdb._attributes_from_line, line) != outcome(_reference_attributes_from_line, line):
+            mismatches.append(line)
+    return mismatches
+
+def _serial_parse(tlpdb_path, allow_partial, compact=False):
+    """packages_from_tlpdb, returning the mirror it sets in TLPackage.mirror as a third value."""
+    saved_mirror = parse_tlpdb.TLPackage.mirror
+    parse_tlpdb.TLPackage.mirror = None
+    try:
+        with open(tlpdb_path, "r") as flat_tlpdb:
+            packages, index_map = parse_tlpdb.packages_from_tlpdb(flat_tlpdb, allow_partial, compact=compact)
+        return packages, index_map, parse_tlpdb.TLPackage.mirror
+    finally:
+        parse_tlpdb.TLPackage.mirror = saved_mirror
+
+def _parser_variants(tlpdb_path, allow_partial):
+    """Returns (name, parse) pairs for each way parse_tlpdb has of loading a whole tlpdb.
+
+    Each parse returns a list of packages, the index dictionary and the mirror.
+
+    """
+
+    def _update():
+        with open(tlpdb_path, "r") as flat_tlpdb:
+            packages, index_map, delta, mirror = parse_tlpdb.update_packages_from_tlpdb(flat_tlpdb, [], allow_partial)
+        return packages, index_map, mirror
+
+    return (("packages_from_tlpdb", lambda: _serial_parse(tlpdb_path, allow_partial)),
+            ("parallel_packages_from_tlpdb with 2 jobs", lambda: parse_tlpdb.parallel_packages_from_tlpdb(tlpdb_path, 2, allow_partial)),
+            ("parallel_packages_from_tlpdb with 3 jobs", lambda: parse_tlpdb.parallel_packages_from_tlpdb(tlpdb_path, 3, allow_partial)),
+            ("packages_from_tlpdb with compact", lambda: _serial_parse(tlpdb_path, allow_partial, compact=True)),
+            ("packages_from_mapped_tlpdb", lambda: parse_tlpdb.packages_from_mapped_tlpdb(tlpdb_path, allow_partial)),
+            ("lazy_packages_from_tlpdb", lambda: parse_tlpdb.lazy_packages_from_tlpdb(tlpdb_path, allow_partial)),
+            ("update_packages_from_tlpdb", _update))
+
+def verify_parsers(packages=300, seed=0):
+    """Differential test of the tlpdb loaders in parse_tlpdb against packages_from_tlpdb.
+
+    Writes a synthetic tlpdb with a location-url line, a copy with CRLF line
+    endings and a copy with a junk line in the middle of a record, as well as
+    a short copy of its first records with a junk line, and loads
+    each with every loader in _parser_variants, with and without allow_partial.
+    Each must give the same dictionary_value() for every package, the same
+    index dictionary and the same mirror, or raise the same exception, whether
+    while loading or while reading packages that are parsed on demand.
+    Returns a list of (tlpdb, allow_partial, loader) tuples that didn't match.
+
+    """
+
+    def outcome(parse):
+        try:
+            loaded, index_map, mirror = parse()
+            return [package.dictionary_value() for package in loaded], index_map, mirror
+        except Exception as e:
+            return ("%s: %s" % (e.__class__.__name__, e),)
+
+    outdir = tempfile.mkdtemp(prefix="benchmark_tlpdb")
+    tlpdb_path = os.path.join(outdir, "texlive.tlpdb")
+    mismatches = []
+    try:
+        with open(tlpdb_path, "w") as output:
+            write_synthetic_tlpdb(output, packages=packages, mirror="http://mirror.example.org/systems/texlive/tlnet", seed=seed)
+        with open(tlpdb_path, "r") as synthetic:
+            text = synthetic.read()
+        # a revision that isn't a number, in a record about halfway through
+        junk_pos = text.index("\nrevision ", len(text) // 2)
+        # the same in the first few dozen records, so that with 3 jobs the
+        # junk is in the middle piece and every piece is shorter than what
+        # the parser reads ahead
+        short_text = text[:text.index("\n\n", len(text) // 6) + 2]
+        short_junk_pos = short_text.index("\nrevision ", len(short_text) // 2)
+        tlpdbs = (("synthetic", text),
+                  ("CRLF", text.replace("\n", "\r\n")),
+                  ("junk line", text[:junk_pos] + "\nrevision junk" + text[junk_pos:]),
+                  ("short junk line", short_text[:short_junk_pos] + "\nrevision junk" + short_text[short_junk_pos:]))
+        
+        for tlpdb_name, tlpdb_text in tlpdbs:
+            # binary, so CRLF line endings are written as is
+            with open(tlpdb_path, "wb") as output:
+                output.write(tlpdb_text.encode("utf-8"))
+            for allow_partial in (False, True):
+                variants = _parser_variants(tlpdb_path, allow_partial)
+                expected = outcome(variants[0][1])
+                for loader, parse in variants[1:]:
+                    if outcome(parse) != expected:
+                        mismatches.append((tlpdb_name, allow_partial, loader))
+    finally:
+        if os.path.exists(tlpdb_path):
+            os.remove(tlpdb_path)
+        os.rmdir(outdir)
+    return mismatches
+
+def _git_revision():
+    """Returns the HEAD commit of the checkout containing this script, or None."""
+    from subprocess import Popen, PIPE
+    try:
+        git = Popen(["git", "rev-parse", "HEAD"], stdout=PIPE, stderr=PIPE, universal_newlines=True,
+                    cwd=os.path.dirname(os.path.abspath(__file__)))
+        (stdout, stderr) = git.communicate()
+    except Exception as e:
+        return None
+    return stdout.strip() if git.returncode == 0 else None
+
+def _cpu_count():
+    """Returns the number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    import multiprocessing
+    return multiprocessing.cpu_count()
+
+def _time_call(func, repeat):
+    """Calls func repeat times; returns a timing dictionary and the last return value."""
+    runs = []
+    result = None
+    for i in range(repeat):
+        start = _timer()
+        result = func()
+        runs.append(_timer() - start)
+    return { "best" : min(runs), "mean" : sum(runs) / len(runs), "runs" : runs }, result
+
+def _depgraph_queries(packages, queries=1000, seed=0):
+    """Builds a DependencyGraph and asks what scheme-full pulls in without a few random collections."""
+    graph = tlpdb_depgraph.DependencyGraph(packages)
+    if "scheme-full" not in graph:
+        return 0
+    rng = random.Random(seed)
+    collections = [name for name in graph.names if name.startswith("collection-")]
+    total = 0
+    for i in range(queries):
+        total += graph.closure_size(["scheme-full"], rng.sample(collections, min(3, len(collections))))
+    return total
+
+# never needed to write a plist, so the fast path mustn't import them
+_STARTUP_UNEXPECTED_MODULES = ("optparse", "gettext", "locale", "textwrap", "plistlib", "sqlite3", "json", "pickle",
+                               "marshal", "lzma", "gzip", "bz2", "mmap", "concurrent", "platform", "hashlib",
+                               "tracemalloc", "cProfile", "socketserver", "tlpdb_server", "tlpdb_depgraph")
+
+def _imported_modules(argv):
+    """Runs a Python command line with -X importtime; returns the total import time in seconds and a set of module names."""
+    from subprocess import Popen, PIPE
+    process = Popen([sys.executable, "-X", "importtime"] + argv, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+    (stdout, stderr) = process.communicate()
+    total = 0
+    modules = set()
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or line.endswith("imported package"):
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        total += int(self_time)
+        modules.add(name.strip())
+    return total / 1e6, modules
+
+def measure_startup(repeat=10):
+    """Times cold starts of parse_tlpdb.py writing a plist of a one-package tlpdb.
+    
+    Returns:
+    A timing dictionary for the plist fast path that TLMDatabase uses, with
+    the bare interpreter and the full command line handling for comparison,
+    the import time of the fast path from -X importtime, the modules it
+    imports beyond what the interpreter always does, and any of those that
+    are in _STARTUP_UNEXPECTED_MODULES.
+    
+    """
+    from subprocess import call
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_tlpdb.py")
+    fd, tlpdb_path = tempfile.mkstemp(suffix=".tlpdb")
+    with os.fdopen(fd, "w") as output:
+        output.write("name minimal\nrevision 1\n\n")
+    fd, plist_path = tempfile.mkstemp(suffix=".plist")
+    os.close(fd)
+    fast_path = [script, "-o", plist_path, "-f", "plist", tlpdb_path]
+    # any option the fast path doesn't know goes through optparse
+    full_cli = [script, "--cache-size", "256", "-o", plist_path, "-f", "plist", tlpdb_path]
+    try:
+        with open(os.devnull, "w") as devnull:
+            def _command(argv):
+                return lambda: call([sys.executable] + argv, stdout=devnull)
+            timing, ignored = _time_call(_command(fast_path), repeat)
+            timing["interpreter_best"] = _time_call(_command(["-c", "pass"]), repeat)[0]["best"]
+            timing["full_cli_best"] = _time_call(_command(full_cli), repeat)[0]["best"]
+        baseline_time, baseline_modules = _imported_modules(["-c", "pass"])
+        import_time, modules = _imported_modules(fast_path)
+        timing["import_seconds"] = import_time - baseline_time
+        timing["imports"] = sorted(modules - baseline_modules)
+        timing["unexpected_imports"] = [name for name in timing["imports"] if name.split(".")[0] in _STARTUP_UNEXPECTED_MODULES]
+    finally:
+        os.remove(tlpdb_path)
+        os.remove(plist_path)
+    return timing
+
+def run_benchmark(tlpdb_path, repeat=3, phases=("parse", "plist", "sqlite3")):
+    """Time each phase of parse_tlpdb against the tlpdb at tlpdb_path.
+
+    Arguments:
+    tlpdb_path -- path to a flat tlpdb
+    repeat -- number of runs per phase; best and mean are both reported
+    phases -- any of "parse", "plist", "sqlite3", "compact", "mmap", "lazy",
+    "snapshot", "parallel", "depgraph" and "startup"; compact parses into
+    CompactTLPackage objects, mmap splits the tlpdb into records without
+    parsing them, lazy parses everything but the file lists, snapshot loads a
+    snapshot and refreshes it from the unchanged tlpdb, as --snapshot does
+    when nothing was updated, parallel parses with one worker per CPU and
+    also reports the CPU time of this process, which is what merging the
+    workers' packages costs, depgraph builds the dependency graph and runs
+    1000 closure queries, and startup times parse_tlpdb.py cold starts (see
+    measure_startup)
+
+    Returns:
+    A dictionary suitable for serializing as JSON.  Phases that raise an
+    exception are recorded with an "error" key instead of timings, so a
+    broken writer doesn't hide the numbers for the others.
+
+    """
+
+    def _parse():
+        with open(tlpdb_path, "r") as flat_tlpdb:
+            return parse_tlpdb.packages_from_tlpdb(flat_tlpdb)
+
+    with open(tlpdb_path, "r") as flat_tlpdb:
+        line_count = sum(1 for line in flat_tlpdb)
+
+    results = {}
+    results["python"] = sys.version.split()[0]
+    results["revision"] = _git_revision()
+    results["date"] = time()
+    results["input"] = { "path" : tlpdb_path, "bytes" : os.path.getsize(tlpdb_path), "lines" : line_count }
+    results["timings"] = {}
+
+    # always parse once, since the writers need packages
+    timing, (packages, index_map) = _time_call(_parse, repeat if "parse" in phases else 1)
+    if "parse" in phases:
+        results["timings"]["parse"] = timing
+    results["input"]["packages"] = len(packages)
+
+    outdir = tempfile.mkdtemp(prefix="benchmark_tlpdb")
+    writers = (("plist", parse_tlpdb._save_as_plist, "out.plist"), ("sqlite3", parse_tlpdb._save_as_sqlite, "out.sqlite3"))
+    for phase, writer, filename in writers:
+        if phase not in phases:
+            continue
+        output_path = os.path.join(outdir, filename)
+        try:
+            timing, ignored = _time_call(lambda: writer(packages, output_path), repeat)
+            timing["output_bytes"] = os.path.getsize(output_path)
+            results["timings"][phase] = timing
+        except Exception as e:
+            results["timings"][phase] = { "error" : "%s: %s" % (e.__class__.__name__, e) }
+        finally:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+    os.rmdir(outdir)
+
+    if "mmap" in phases:
+        timing, ignored = _time_call(lambda: parse_tlpdb.packages_from_mapped_tlpdb(tlpdb_path), repeat)
+        results["timings"]["mmap"] = timing
+
+    if "compact" in phases:
+        def _parse_compact():
+            with open(tlpdb_path, "r") as flat_tlpdb:
+                return parse_tlpdb.packages_from_tlpdb(flat_tlpdb, compact=True)
+        timing, ignored = _time_call(_parse_compact, repeat)
+        results["timings"]["compact"] = timing
+
+    if "lazy" in phases:
+        timing, ignored = _time_call(lambda: parse_tlpdb.lazy_packages_from_tlpdb(tlpdb_path), repeat)
+        results["timings"]["lazy"] = timing
+
+    if "snapshot" in phases:
+        fd, snapshot_path = tempfile.mkstemp(suffix=".snapshot")
+        os.close(fd)
+        def _refresh():
+            previous_packages, mirror = parse_tlpdb.load_snapshot(snapshot_path)
+            return parse_tlpdb.update_packages_from_tlpdb(tlpdb_path, previous_packages)
+        try:
+            parse_tlpdb.save_snapshot(packages, snapshot_path)
+            timing, ignored = _time_call(_refresh, repeat)
+            timing["snapshot_bytes"] = os.path.getsize(snapshot_path)
+            results["timings"]["snapshot"] = timing
+        finally:
+            os.remove(snapshot_path)
+
+    if "parallel" in phases:
+        # at least two, or it's the serial parse again
+        jobs = max(_cpu_count(), 2)
+        cpu_started = _cpu_timer()
+        timing, ignored = _time_call(lambda: parse_tlpdb.parallel_packages_from_tlpdb(tlpdb_path, jobs), repeat)
+        timing["jobs"] = jobs
+        timing["cpus"] = _cpu_count()
+        timing["parent_cpu_mean"] = (_cpu_timer() - cpu_started) / repeat
+        results["timings"]["parallel"] = timing
+
+    if "depgraph" in phases:
+        timing, ignored = _time_call(lambda: _depgraph_queries(packages), repeat)
+        results["timings"]["depgraph"] = timing
+        
+    if "startup" in phases:
+        # a process start is short and noisy, so take the best of more runs
+        results["timings"]["startup"] = measure_startup(max(repeat, 10))
+
+    return results
+
+def compare_results(baseline, current, tolerance):
+    """Compare best times per phase.
+
+    Returns a list of (phase, baseline_seconds, current_seconds, ratio) tuples
+    and a list of phases that regressed by more than tolerance, which is a ratio
+    like 1.10 for 10%.
+
+    """
+    rows = []
+    regressions = []
+    for phase in sorted(current["timings"]):
+        new = current["timings"][phase]
+        old = baseline["timings"].get(phase)
+        if old is None or "best" not in old or "best" not in new:
+            continue
+        ratio = new["best"] / old["best"] if old["best"] else float("inf")
+        rows.append((phase, old["best"], new["best"], ratio))
+        if ratio > tolerance:
+            regressions.append(phase)
+    return rows, regressions
+
+if __name__ == '__main__':
+
+    from optparse import OptionParser
+
+    usage = "usage: %prog [options] [tlpdb_path]\n\nWith no tlpdb_path, a synthetic tlpdb is generated and benchmarked."
+    parser = OptionParser()
+    parser.set_usage(usage)
+    parser.add_option("-o", "--output", dest="output_path", help="write JSON results to FILE (default is stdout)", metavar="FILE", action="store", type="string")
+    parser.add_option("-c", "--compare", dest="baseline_path", help="compare against JSON results in FILE", metavar="FILE", action="store", type="string")
+    parser.add_option("-t", "--tolerance", dest="tolerance", help="exit nonzero if any phase is slower than baseline by this ratio (default 1.10)", action="store", type="float", default=1.10)
+    parser.add_option("-r", "--repeat", dest="repeat", help="runs per phase (default 3)", action="store", type="int", default=3)
+    parser.add_option("--phase", dest="phases", help="phase to run: parse, plist, sqlite3, compact, mmap, lazy, snapshot, parallel, depgraph or startup; may be repeated (default is all)", action="append", metavar="PHASE")
+    parser.add_option("-g", "--generate", dest="generate_path", help="only write a synthetic tlpdb to FILE and exit", metavar="FILE", action="store", type="string")
+    parser.add_option("--packages", dest="packages", help="synthetic packages (default 5000)", action="store", type="int", default=5000)
+    parser.add_option("--runfiles", dest="runfiles", help="synthetic runfiles per package (default 20)", action="store", type="int", default=20)
+    parser.add_option("--srcfiles", dest="srcfiles", help="synthetic srcfiles per package (default 2)", action="store", type="int", default=2)
+    parser.add_option("--docfiles", dest="docfiles", help="synthetic docfiles per package (default 6)", action="store", type="int", default=6)
+    parser.add_option("--binfiles", dest="binfiles", help="synthetic binfiles per architecture (default 3)", action="store", type="int", default=3)
+    parser.add_option("--archs", dest="archs", help="number of synthetic architectures (default %d)" % (len(DEFAULT_ARCHS)), action="store", type="int", default=len(DEFAULT_ARCHS))
+    parser.add_option("--longdesc", dest="longdesc_lines", help="synthetic longdesc lines per package (default 4)", action="store", type="int", default=4)
+    parser.add_option("--seed", dest="seed", help="random seed for the synthetic tlpdb (default 0)", action="store", type="int", default=0)
+    parser.add_option("--verify", dest="verify", help="check the attribute parser against the original implementation and every tlpdb loader against packages_from_tlpdb, and exit", action="store_true", default=False)
+
+    (options, args) = parser.parse_args(sys.argv[1:])
+
+    if options.verify:
+        mismatches = verify_attribute_parser(seed=options.seed)
+        for line in mismatches[:20]:
+            sys.stderr.write("attribute parser mismatch: %r\n" % (line))
+        sys.stderr.write("%d attribute parser mismatches\n" % (len(mismatches)))
+        parser_mismatches = verify_parsers(seed=options.seed)
+        for tlpdb_name, allow_partial, loader in parser_mismatches:
+            sys.stderr.write("%s differs from packages_from_tlpdb for the %s tlpdb%s\n" % (loader, tlpdb_name, " with allow_partial" if allow_partial else ""))
+        sys.stderr.write("%d tlpdb loader mismatches\n" % (len(parser_mismatches)))
+        exit(1 if mismatches or parser_mismatches else 0)
+
+    archs = DEFAULT_ARCHS[:options.archs] if options.archs <= len(DEFAULT_ARCHS) else DEFAULT_ARCHS + tuple("synthetic%d-arch" % (i) for i in range(options.archs - len(DEFAULT_ARCHS)))
+    generator_options = { "packages" : options.packages, "runfiles" : options.runfiles, "srcfiles" : options.srcfiles,
+                          "docfiles" : options.docfiles, "binfiles" : options.binfiles, "archs" : archs,
+                          "longdesc_lines" : options.longdesc_lines, "seed" : options.seed }
+
+    if options.generate_path:
+        with open(options.generate_path, "w") as output:
+            write_synthetic_tlpdb(output, **generator_options)
+        exit(0)
+
+    synthetic_path = None
+    if len(args):
+        tlpdb_path = args[0]
+    else:
+        fd, synthetic_path = tempfile.mkstemp(suffix=".tlpdb")
+        with os.fdopen(fd, "w") as output:
+            write_synthetic_tlpdb(output, **generator_options)
+        tlpdb_path = synthetic_path
+
+    try:
+        results = run_benchmark(tlpdb_path, options.repeat, options.phases if options.phases else ("parse", "plist", "sqlite3", "compact", "mmap", "lazy", "snapshot", "parallel", "depgraph", "startup"))
+    finally:
+        if synthetic_path:
+            os.remove(synthetic_path)
+
+    if synthetic_path:
+        generator_options["archs"] = len(archs)
+        results["input"]["path"] = None
+        results["input"]["synthetic"] = generator_options
+
+    json_output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output_path:
+        with open(options.output_path, "w") as output:
+            output.write(json_output + "\n")
+    else:
+        sys.stdout.write(json_output + "\n")
+
+    status = 0
+    if options.baseline_path:
+        with open(options.baseline_path, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        rows, regressions = compare_results(baseline, results, options.tolerance)
+        for phase, old, new, ratio in rows:
+            sys.stderr.write("%-8s %8.3fs -> %8.3fs  (%.2fx)%s\n" % (phase, old, new, ratio, "  REGRESSION" if phase in regressions else ""))
+        if regressions:
+            status = 1
+            
+    unexpected_imports = results["timings"].get("startup", {}).get("unexpected_imports")
+    if unexpected_imports:
+        sys.stderr.write("parse_tlpdb.py imports %s when writing a plist\n" % (", ".join(unexpected_imports)))
+        status = 1
+
+    exit(status)
@@ -47,13 +47,15 @@ python_major_version = sys.version_info[0]
 # rather than strings now.  This trips up plistlib.PlistWriter, which expects to be writing strings.  As a hack around
 # that, I'm writing to a StringIO object, and then writing that to sys.stdout.  Not the best way of doing things, but
 # until I know of something better, this is it.
+import gc
 import io
+import re
     
 class TLPackage(object):
     """TeX Live Package
     
     Conceptually this is nothing more than a dictionary.  It's able to
-    convert itself to an sqlite3 row and a dictionary value.
+    convert itself to sqlite3 rows and a dictionary value.
     
     """
     mirror = None
@@ -113,12 +115,16 @@ class TLPackage(object):
             s += "\n  %s = %s" % (k, self.extradata[k])
         return s
         
-    def dictionary_value(self):
+    def dictionary_value(self, fields=None):
         """Returns a dictionary with name as key and attributes as key-value pairs.
         
         NOTE: not all attributes are saved, because I don't need all of them.  So if
         you don't see one in the plist, it may just need to be added as a line here.
         
+        Arguments:
+        fields -- keys to include (see PACKAGE_FIELDS), or None for all of them;
+        name is always included
+        
         """
         kv = {}
         kv["name"] = self.name
@@ -135,318 +141,3022 @@ class TLPackage(object):
         if self.docfiles: kv["docFiles"] = self.docfiles
         if self.extradata: kv["extradata"] = self.extradata
         if self.docfiledata: kv["docFileData"] = self.docfiledata
+        if fields is not None:
+            for key in list(kv):
+                if key != "name" and key not in fields:
+                    del kv[key]
         return kv
         
-    def insert_in_packages(self, conn):
-        """Inserts in an open SQLite3 database.  Limited support."""
-        # c.execute("""CREATE table packages (name text, category text, revision real, shortdesc text, longdesc text, srcfiles blob, binfiles blob, docfiles blob)""")
-        c = conn.cursor()
-        c.execute("""INSERT into packages values (?,?,?,?,?,?,?,?)""", (self.name, self.category, self.revision, self.shortdesc, self.longdesc, self.runfiles, self.srcfiles, self.docfiles))
-        conn.commit()
+    def sqlite_rows(self, package_id):
+        """Returns rows for the tables in _SQLITE_SCHEMA.
+        
+        Arguments:
+        package_id -- integer primary key to use for this package
+        
+        Returns:
+        A dictionary mapping table name to a list of row tuples, in column order.
+        
+        """
+        pid = package_id
+        rows = {}
+        rows["packages"] = [(pid, self.name, self.category, self.revision, self.shortdesc, self.longdesc,
+                             self.catalogue, self.relocated, self.runsize, self.srcsize, self.docsize)]
+        files = [(pid, path, "run", None) for path in self.runfiles]
+        files += [(pid, path, "src", None) for path in self.srcfiles]
+        files += [(pid, path, "doc", None) for path in self.docfiles]
+        for arch in self.binfiles:
+            files += [(pid, path, "bin", arch) for path in self.binfiles[arch]]
+        rows["files"] = files
+        rows["binsizes"] = [(pid, arch, self.binsize[arch]) for arch in self.binsize]
+        rows["depends"] = [(pid, dep) for dep in self.depends]
+        docfiledata = []
+        for path in self.docfiledata:
+            attrs = self.docfiledata[path]
+            docfiledata += [(pid, path, key, attrs[key]) for key in attrs]
+        rows["docfiledata"] = docfiledata
+        rows["catalogue"] = [(pid, key, self.cataloguedata[key]) for key in self.cataloguedata]
+        rows["actions"] = [(pid, "execute", value) for value in self.executes] + [(pid, "postaction", value) for value in self.postactions]
+        rows["extradata"] = [(pid, key, self.extradata[key]) for key in self.extradata]
+        return rows
+
+try:
+    from sys import intern as _intern
+except ImportError:
+    _intern = intern
+    
+class _CompactionTables(object):
+    """Strings and values shared between the CompactTLPackage objects of one load."""
+    
+    def __init__(self):
+        super(_CompactionTables, self).__init__()
+        # directory prefixes, including the trailing slash, keyed by themselves so
+        # that "/x" and "x" don't share the empty directory
+        self.directories = []
+        self.directory_indexes = {}
+        # identical docfile attribute dictionaries, e.g. {"details" : "Readme"}
+        self.attribute_dicts = {}
+        
+    def _directory_index(self, prefix):
+        idx = self.directory_indexes.get(prefix)
+        if idx is None:
+            idx = len(self.directories)
+            self.directory_indexes[prefix] = idx
+            self.directories.append(prefix)
+        return idx
+        
+    def pack_paths(self, paths):
+        """Returns a tuple of alternating directory indexes and newline-joined basenames, or None for no paths.
+        
+        Consecutive paths in the same directory, which is most of them, share
+        one entry, so a package's runfiles usually take a few strings.
+        
+        """
+        if not paths:
+            return None
+        # Usually every path is in the same directory, which two counts of the
+        # joined paths can tell without looking at each one: a line can only
+        # start with the directory of the first path, and then has a slash
+        # after it if it's in a subdirectory.
+        directory, slash, name = paths[0].rpartition("/")
+        text = "\n".join(paths)
+        if slash and text.count("\n" + directory + slash) == len(paths) - 1 and text.count("/") == len(paths) * (directory.count("/") + 1):
+            return (self._directory_index(directory + slash), text[len(directory) + 1:].replace("\n" + directory + slash, "\n"))
+            
+        packed = []
+        names = []
+        last_idx = None
+        for path in paths:
+            directory, slash, name = path.rpartition("/")
+            idx = self._directory_index(directory + slash)
+            if idx != last_idx:
+                if names:
+                    packed.append(last_idx)
+                    packed.append("\n".join(names))
+                names = []
+                last_idx = idx
+            names.append(name)
+        packed.append(last_idx)
+        packed.append("\n".join(names))
+        return tuple(packed)
+        
+    def unpack_paths(self, packed):
+        if packed is None:
+            return []
+        directories = self.directories
+        paths = []
+        for idx in range(0, len(packed), 2):
+            directory = directories[packed[idx]]
+            paths.extend([directory + name for name in packed[idx + 1].split("\n")])
+        return paths
+        
+    def shared_attributes(self, attributes):
+        # most docfiles have just details or language, so there's nothing to sort
+        key = tuple(attributes.items()) if len(attributes) == 1 else tuple(sorted(attributes.items()))
+        shared = self.attribute_dicts.get(key)
+        if shared is None:
+            shared = dict((_intern(k), v) for k, v in attributes.items())
+            self.attribute_dicts[key] = shared
+        return shared
+        
+# Shared by every CompactTLPackage that has nothing in a list or dictionary,
+# which is most of them for executes, postactions, binfiles and depends.
+_EMPTY_TUPLE = ()
+_EMPTY_DICT = {}
+
+class CompactTLPackage(object):
+    """Read-only TLPackage that takes a fraction of the memory.
+    
+    Has the same attributes as TLPackage, and dictionary_value() and
+    sqlite_rows() return the same values, but it uses __slots__, shares
+    empty containers and interns categories, architectures, keys and
+    dependency names.  File lists are stored as indexes into a directory
+    table shared by the whole load plus one string of basenames, and are
+    rebuilt as lists of paths each time they're read.  Don't modify
+    anything, since empty containers and docfile attributes are shared.
+    
+    """
+    
+    __slots__ = ("name", "category", "shortdesc", "longdesc", "catalogue", "relocated",
+                 "runsize", "srcsize", "docsize", "executes", "postactions",
+                 "binsize", "depends", "revision", "cataloguedata", "extradata",
+                 "_tables", "_runfiles", "_srcfiles", "_docfiles", "_binfiles", "_docfiledata")
+    
+    def __init__(self, package, tables):
+        super(CompactTLPackage, self).__init__()
+        self.name = package.name
+        self.category = _intern(package.category) if package.category else package.category
+        self.shortdesc = package.shortdesc
+        self.longdesc = package.longdesc
+        self.catalogue = package.catalogue
+        self.relocated = package.relocated
+        self.runsize = package.runsize
+        self.srcsize = package.srcsize
+        self.docsize = package.docsize
+        self.revision = package.revision
+        self.executes = package.executes or _EMPTY_TUPLE
+        self.postactions = package.postactions or _EMPTY_TUPLE
+        self.depends = [_intern(dep) for dep in package.depends] if package.depends else _EMPTY_TUPLE
+        self.binsize = dict((_intern(arch), size) for arch, size in package.binsize.items()) if package.binsize else _EMPTY_DICT
+        self.cataloguedata = dict((_intern(k), v) for k, v in package.cataloguedata.items()) if package.cataloguedata else _EMPTY_DICT
+        self.extradata = dict((_intern(k), v) for k, v in package.extradata.items()) if package.extradata else _EMPTY_DICT
+        self._docfiledata = None
+        if package.docfiledata:
+            # keyed by index in docfiles, so the paths aren't kept twice
+            docfile_indexes = dict((path, idx) for idx, path in enumerate(package.docfiles))
+            docfiledata = []
+            for path, attrs in package.docfiledata.items():
+                docfiledata.append(docfile_indexes.get(path, path))
+                docfiledata.append(tables.shared_attributes(attrs))
+            self._docfiledata = tuple(docfiledata)
+        self._tables = tables
+        self._runfiles = tables.pack_paths(package.runfiles)
+        self._srcfiles = tables.pack_paths(package.srcfiles)
+        self._docfiles = tables.pack_paths(package.docfiles)
+        if package.binfiles:
+            self._binfiles = dict((_intern(arch), tables.pack_paths(files)) for arch, files in package.binfiles.items())
+        else:
+            self._binfiles = None
+            
+    @property
+    def runfiles(self):
+        return self._tables.unpack_paths(self._runfiles)
+        
+    @property
+    def srcfiles(self):
+        return self._tables.unpack_paths(self._srcfiles)
+        
+    @property
+    def docfiles(self):
+        return self._tables.unpack_paths(self._docfiles)
+        
+    @property
+    def docfiledata(self):
+        if self._docfiledata is None:
+            return {}
+        docfiles = self.docfiles
+        packed = self._docfiledata
+        docfiledata = {}
+        for idx in range(0, len(packed), 2):
+            key = packed[idx]
+            docfiledata[docfiles[key] if isinstance(key, int) else key] = packed[idx + 1]
+        return docfiledata
+        
+    @property
+    def binfiles(self):
+        if self._binfiles is None:
+            return {}
+        unpack_paths = self._tables.unpack_paths
+        return dict((arch, unpack_paths(packed)) for arch, packed in self._binfiles.items())
+        
+    # the same implementations as TLPackage, since the attributes are the same
+    __repr__ = TLPackage.__dict__["__repr__"]
+    __str__ = TLPackage.__dict__["__str__"]
+    dictionary_value = TLPackage.__dict__["dictionary_value"]
+    sqlite_rows = TLPackage.__dict__["sqlite_rows"]
+    
+# One key=value pair, followed by a single space or the end of the line.  The key
+# can't contain quotes, and values are made of unquoted characters and quoted
+# runs, which may contain spaces and "=".  A quote that isn't closed runs to the
+# end of the line.
+_ATTRIBUTE_PAIR_RE = re.compile(r'([^=" ]*)=((?:[^" ]+|"[^"]*(?:"|\Z))*)( |\Z)')
 
 def _attributes_from_line(line):
     """Parse an attribute line.
     
-    Arguments:
-    line -- a single line from the tlpdb
+    Arguments:
+    line -- a single line from the tlpdb
+    
+    Returns:
+    A dictionary of attributes
+    
+    Example input lines:
+    
+        arch=x86_64-darwin size=1
+        details="Package introduction" language="de"
+        RELOC/doc/platex/pxbase/README details="Readme" language="ja"
+    
+    Quotes are removed from values.  An AssertionError is raised for a pair without
+    a key, a quoted key, a repeated key or an empty value at the end of the line.
+    
+    """
+    
+    attrs = {}
+    
+    # most lines have no quotes, so just split on spaces
+    if "\"" not in line:
+        pairs = line.split(" ")
+        last_pair = pairs.pop()
+        for pair in pairs:
+            key, sep, value = pair.partition("=")
+            assert sep, "no key found for %s" % (line)
+            assert key not in attrs, "key already assigned for line %s" % (line)
+            attrs[key] = value
+        key, sep, value = last_pair.partition("=")
+        assert sep, "no key found for %s" % (line)
+        assert len(value), "no values found for line %s" % (line)
+        attrs[key] = value
+        return attrs
+        
+    match = _ATTRIBUTE_PAIR_RE.match
+    pos = 0
+    while True:
+        m = match(line, pos)
+        if m is None:
+            # Only the key can fail to match, since a quote in a value always
+            # starts a quoted run.  Quotes before an "=" are a quoted key; a
+            # space outside quotes or the end of the line means no key.
+            quote_count = 0
+            for c in line[pos:]:
+                if c == "\"":
+                    quote_count += 1
+                elif c == "=":
+                    assert quote_count == 0, "possibly quoted key in line %s" % (line)
+                    break
+                elif c == " " and quote_count % 2 == 0:
+                    break
+            assert False, "no key found for %s" % (line)
+        key, value, sep = m.groups()
+        value = value.replace("\"", "")
+        pos = m.end()
+        if not sep:
+            break
+        assert key not in attrs, "key already assigned for line %s" % (line)
+        attrs[key] = value
+        
+    assert len(value), "no values found for line %s" % (line)
+    attrs[key] = value
+    return attrs
+
+class _BadDocfileLine(Exception):
+    """Raised for a docfiles line that should be skipped instead of aborting the parse."""
+    pass
+
+def _skip_docfile_line(line_idx, record, line):
+    sys.stderr.write("skipping bad docfile line %d in package %s: %s\n" % (line_idx, record.package.name, line.strip("\r\n")))
+    
+class _RecordParser(object):
+    """Parser state for a single tlpdb record.
+    
+    Text that can span several lines (longdesc) is gathered in a list and joined
+    once by finish(), instead of being concatenated line by line.
+    
+    """
+    __slots__ = ("package", "longdesc", "binfile_arch", "attribute_cache", "archs", "dropped_archs")
+    
+    def __init__(self, attribute_cache, archs=None):
+        super(_RecordParser, self).__init__()
+        self.package = TLPackage()
+        self.longdesc = []
+        self.binfile_arch = None
+        # maps docfile attribute strings to parsed attributes; the same few
+        # details/language strings are repeated across thousands of packages
+        self.attribute_cache = attribute_cache
+        # architectures to keep binfiles for, or None for all of them
+        self.archs = archs
+        self.dropped_archs = None
+        
+    def add_binfile(self, value):
+        """Continuation line for binfiles; the list is only created if there is a file."""
+        binfiles = self.package.binfiles
+        if self.binfile_arch in binfiles:
+            binfiles[self.binfile_arch].append(value)
+        else:
+            binfiles[self.binfile_arch] = [value]
+        
+    def add_docfile(self, value):
+        """Continuation line for docfiles, with optional attributes after the path."""
+        # There's an exception handler here because a TL update introduced this abomination:
+        #   texmf-dist/doc/latex/pythontex/pythontex_quickstart.pdf details=""Quick start" documentation"
+        # due to a bug in the TeX Catalogue. TLPOBJ.pm uses a gruesome special case to handle this, but
+        # I'm just going to ignore it unless/until it happens again, since it's supposed to be fixed in
+        # the tlpdb at some point.
+        path, sep, attributes = value.partition(" ")
+        if sep:
+            attrs = self.attribute_cache.get(attributes)
+            if attrs is None:
+                try:
+                    attrs = _attributes_from_line(attributes)
+                except Exception as e:
+                    raise _BadDocfileLine()
+                self.attribute_cache[attributes] = attrs
+            # copy, so packages don't share mutable attribute dictionaries
+            self.package.docfiledata[path] = dict(attrs)
+        self.package.docfiles.append(path)
+        
+    def add_docfile_path(self, value):
+        """Continuation line for docfiles when only the paths are wanted."""
+        path, sep, attributes = value.partition(" ")
+        # still checked, so the same lines are skipped as by add_docfile
+        if sep and attributes not in self.attribute_cache:
+            try:
+                self.attribute_cache[attributes] = _attributes_from_line(attributes)
+            except Exception as e:
+                raise _BadDocfileLine()
+        self.package.docfiles.append(path)
+        
+    def finish(self):
+        """Returns the completed TLPackage, or None if it's for an architecture that wasn't asked for."""
+        package = self.package
+        # e.g. asymptote.windows, which only has binfiles for windows
+        if self.dropped_archs and package.name.rpartition(".")[2] in self.dropped_archs:
+            return None
+        if self.longdesc:
+            # each longdesc line used to be appended as " " + value
+            package.longdesc = " " + " ".join(self.longdesc)
+            if python_major_version < 3:
+                package.longdesc = package.longdesc.decode("utf-8")
+        return package
+        
+def _size_from_header(record, key, value):
+    # almost always just "size=N", which doesn't need the attribute parser
+    if value.startswith("size=") and value[5:].isdigit():
+        return int(value[5:])
+    attrs = _attributes_from_line(value)
+    assert "size" in attrs, "missing size for %s : %s" % (record.package.name, key)
+    return int(attrs["size"])
+    
+# Handlers for keyed lines in a record.  Each is called as handler(record, value)
+# and returns either None or a callable that takes the value of each following
+# continuation line (the ones with a leading space).  Continuation lines after a
+# handler that returns None are handled as if they repeated the previous key.
+
+def _parse_name(record, value):
+    record.package.name = value
+    
+def _parse_category(record, value):
+    record.package.category = value
+    
+def _parse_revision(record, value):
+    record.package.revision = int(value)
+    
+def _parse_relocated(record, value):
+    record.package.relocated = int(value)
+    
+if python_major_version < 3:
+    def _parse_shortdesc(record, value):
+        record.package.shortdesc = value.decode("utf-8")
+else:
+    def _parse_shortdesc(record, value):
+        record.package.shortdesc = value
+        
+def _parse_longdesc(record, value):
+    record.longdesc.append(value)
+    
+def _parse_depend(record, value):
+    if record.archs is not None and value.endswith(".ARCH"):
+        # what tlmgr would install for this package on those platforms
+        prefix = value[:-len("ARCH")]
+        record.package.depends.extend([prefix + arch for arch in record.archs])
+    else:
+        record.package.depends.append(value)
+    
+def _parse_catalogue(record, value):
+    record.package.catalogue = value
+    
+def _parse_postaction(record, value):
+    record.package.postactions.append(value)
+    
+def _parse_execute(record, value):
+    record.package.executes.append(value)
+    
+def _parse_srcfiles(record, value):
+    record.package.srcsize = _size_from_header(record, "srcfiles", value)
+    return record.package.srcfiles.append
+    
+def _parse_runfiles(record, value):
+    record.package.runsize = _size_from_header(record, "runfiles", value)
+    return record.package.runfiles.append
+    
+def _parse_docfiles(record, value):
+    try:
+        record.package.docsize = _size_from_header(record, "docfiles", value)
+    except Exception as e:
+        raise _BadDocfileLine()
+    return record.add_docfile
+    
+def _parse_binfiles(record, value):
+    package = record.package
+    attrs = _attributes_from_line(value)
+    assert "arch" in attrs, "missing arch for %s : %s" % (package.name, "binfiles")
+    arch = attrs["arch"]
+    assert "size" in attrs, "missing size for %s : %s" % (package.name, "binfiles")
+    if record.archs is not None and arch not in record.archs:
+        if record.dropped_archs is None:
+            record.dropped_archs = set()
+        record.dropped_archs.add(arch)
+        int(attrs["size"])
+        return _discard_line
+    package.binsize[arch] = int(attrs["size"])
+    record.binfile_arch = arch
+    return record.add_binfile
+    
+def _catalogue_handler(catkey):
+    def _parse_catalogue_key(record, value):
+        record.package.cataloguedata[catkey] = value
+    return _parse_catalogue_key
+    
+def _extra_handler(key):
+    def _parse_extra(record, value):
+        # as add_pair does, without another call for every containersize and containerchecksum
+        record.package.extradata[key] = value
+    return _parse_extra
+    
+def _skip_value(record, value):
+    pass
+    
+def _discard_line(value):
+    """Continuation line for a file list that isn't wanted; the parser checks for this before stripping the line."""
+    pass
+    
+def _handler_for_key(key, fields=None):
+    """Handler for a key that isn't in _KEY_HANDLERS."""
+    if key.startswith("catalogue-"):
+        if fields is not None and "catalogueData" not in fields:
+            return _skip_value
+        return _catalogue_handler(key[len("catalogue-"):])
+    if fields is not None and "extradata" not in fields:
+        return _skip_value
+    return _extra_handler(key)
+    
+_KEY_HANDLERS = {
+    "name" : _parse_name,
+    "category" : _parse_category,
+    "revision" : _parse_revision,
+    "relocated" : _parse_relocated,
+    "shortdesc" : _parse_shortdesc,
+    "longdesc" : _parse_longdesc,
+    "depend" : _parse_depend,
+    "catalogue" : _parse_catalogue,
+    "srcfiles" : _parse_srcfiles,
+    "binfiles" : _parse_binfiles,
+    "docfiles" : _parse_docfiles,
+    "runfiles" : _parse_runfiles,
+    "postaction" : _parse_postaction,
+    "execute" : _parse_execute,
+}
+
+# dictionary_value keys, in order, and the tlpdb keys they're parsed from;
+# catalogueData, extradata and docFileData are handled separately
+PACKAGE_FIELDS = ("name", "category", "revision", "shortDescription", "longDescription", "catalogue", "runFiles",
+                  "sourceFiles", "binFiles", "catalogueData", "depends", "docFiles", "extradata", "docFileData")
+_FIELD_KEYS = {
+    "category" : "category",
+    "revision" : "revision",
+    "shortDescription" : "shortdesc",
+    "longDescription" : "longdesc",
+    "catalogue" : "catalogue",
+    "depends" : "depend",
+    "runFiles" : "runfiles",
+    "sourceFiles" : "srcfiles",
+    "binFiles" : "binfiles",
+}
+
+def _size_only_handler(handler):
+    """Wraps a file list handler, so the size is still parsed but the files are skipped."""
+    def _parse_size_only(record, value):
+        handler(record, value)
+        return _discard_line
+    return _parse_size_only
+    
+def _parse_docfile_paths(record, value):
+    _parse_docfiles(record, value)
+    return record.add_docfile_path
+    
+def _projected_handlers(fields):
+    """Returns a copy of _KEY_HANDLERS that skips values for keys not in fields, and the method for docfiles lines, or None."""
+    handlers = dict(_KEY_HANDLERS)
+    if fields is None:
+        return handlers, "add_docfile"
+    for field in _FIELD_KEYS:
+        if field not in fields:
+            key = _FIELD_KEYS[field]
+            if key.endswith("files"):
+                handlers[key] = _size_only_handler(handlers[key])
+            else:
+                handlers[key] = _skip_value
+    # docFileData is keyed by path, so it needs the docfiles parsed anyway
+    if "docFileData" in fields:
+        return handlers, "add_docfile"
+    if "docFiles" in fields:
+        handlers["docfiles"] = _parse_docfile_paths
+        return handlers, "add_docfile_path"
+    handlers["docfiles"] = _size_only_handler(_parse_docfiles)
+    return handlers, None
+
+# events yielded by iter_packages_from_tlpdb
+MIRROR_EVENT = "mirror"
+PACKAGE_EVENT = "package"
+
+if python_major_version < 3:
+    _string_types = (basestring,)
+else:
+    _string_types = (str,)
+
+# magic numbers, and the module whose open() decompresses each format
+_COMPRESSION_SIGNATURES = ((b"\xfd7zXZ\x00", "lzma"), (b"\x1f\x8b", "gzip"), (b"BZh", "bz2"))
+
+def _decompressor_for(magic):
+    """Returns the module whose open() decompresses a stream starting with magic, or None if it isn't compressed."""
+    for signature, module_name in _COMPRESSION_SIGNATURES:
+        if magic[:len(signature)] == signature:
+            return __import__(module_name)
+    return None
+
+class _PrefixedStream(io.RawIOBase):
+    """A binary stream that gives some bytes already read from another stream, then the rest of it.
+    
+    Closing it leaves the other stream open.
+    
+    """
+    
+    def __init__(self, prefix, stream):
+        super(_PrefixedStream, self).__init__()
+        self._prefix = prefix
+        self._stream = stream
+        
+    def readable(self):
+        return True
+        
+    def readinto(self, buffer):
+        data = self._prefix
+        if data:
+            self._prefix = b""
+        else:
+            # read1 returns whatever a pipe has, instead of waiting for a full buffer
+            data = self._stream.read1(len(buffer)) if hasattr(self._stream, "read1") else self._stream.read(len(buffer))
+        if len(data) > len(buffer):
+            self._prefix = data[len(buffer):]
+            data = data[:len(buffer)]
+        buffer[:len(data)] = data
+        return len(data)
+
+def open_tlpdb(path_or_file):
+    """Opens a tlpdb for reading text, decompressing it on the fly if needed.
+    
+    Arguments:
+    path_or_file -- A path, a file opened in text or binary mode that hasn't
+    been read from yet, or any other iterable of lines
+    
+    Returns:
+    An iterable of lines.  Input compressed with xz, gzip or bzip2, as
+    tlpkg/texlive.tlpdb.xz on a mirror is, is recognized by its magic number
+    and decompressed incrementally, so neither the compressed nor the
+    uncompressed database is ever held in memory or written to disk.  Text
+    files are returned as is, and binary files and paths are read as UTF-8.
+    A file opened here for a path is closed by closing what's returned; a
+    file passed in is left open unless it's closed the same way.
+    
+    """
+    
+    if isinstance(path_or_file, _string_types):
+        with open(path_or_file, "rb") as raw:
+            decompressor = _decompressor_for(raw.read(6))
+        if decompressor is None:
+            return io.open(path_or_file, "r", encoding="utf-8")
+        # opened by path, the decompressor closes the compressed file too
+        return decompressor.open(path_or_file, "rt", encoding="utf-8")
+        
+    # text files like sys.stdin keep the binary stream underneath in buffer
+    raw = getattr(path_or_file, "buffer", path_or_file)
+    if not hasattr(raw, "peek"):
+        return path_or_file
+    magic = raw.peek(6)[:6]
+    if magic and any(len(magic) < len(signature) and signature.startswith(magic) for signature, name in _COMPRESSION_SIGNATURES):
+        # peek only returns what's buffered, which may be a byte or two from a
+        # pipe; read the whole signature, and put it back in front of the rest
+        magic = raw.read(6)
+        raw = io.BufferedReader(_PrefixedStream(magic, raw))
+        path_or_file = raw
+    decompressor = _decompressor_for(magic)
+    if decompressor is not None:
+        return io.TextIOWrapper(decompressor.open(raw, "rb"), encoding="utf-8")
+    if raw is path_or_file:
+        return io.TextIOWrapper(raw, encoding="utf-8")
+    return path_or_file
+
+def _lines_until_truncated(lines):
+    """Yields lines from a decompressing file, stopping quietly if the compressed data was cut off."""
+    try:
+        for line in lines:
+            yield line
+    except EOFError as e:
+        sys.stderr.write("compressed tlpdb is truncated: %s\n" % (e))
+
+def _lines_until_error(lines, errors):
+    """Yields lines, stopping at an exception from reading them, which is appended to errors instead."""
+    try:
+        for line in lines:
+            yield line
+    except Exception as e:
+        errors.append(e)
+        
+def _decompresses(lines):
+    """True for a text file read through one of the decompressors in _COMPRESSION_SIGNATURES."""
+    buffer = getattr(lines, "buffer", None)
+    module_name = buffer.__class__.__module__
+    return any(module_name == name for signature, name in _COMPRESSION_SIGNATURES)
+
+def iter_packages_from_tlpdb(flat_tlpdb, allow_partial=False, first_line=0, archs=None, fields=None):
+    """Parses TLPackage objects from the given file-like object as they arrive.
+    
+    Arguments:
+    flat_tlpdb -- A file or file-like object, open for reading; any iterable of lines will do.
+    Files compressed with xz, gzip or bzip2 are decompressed as they're read; see open_tlpdb.
+    allow_partial -- Pass True if you want to stop quietly after an error;
+    useful in case of a partial tlpdb download. Default is to raise an exception.
+    first_line -- line number of the first line, when parsing part of a tlpdb;
+    only line 0 may be a location-url
+    archs -- architectures to keep, e.g. ["x86_64-linux"], or None for all.
+    binfiles and binsize for other architectures are dropped, as are packages
+    named name.arch for those architectures, and name.ARCH dependencies are
+    replaced by name.arch for each of archs.
+    fields -- dictionary_value keys to parse (see PACKAGE_FIELDS), or None for
+    all.  Values for other keys are skipped instead of being built, so their
+    attributes are left empty, except that file list sizes are always parsed.
+    
+    Yields:
+    Two-tuples of (event, value).  If the first line is a location-url line, as
+    written by tlmgr dump-tlpdb, the first event is (MIRROR_EVENT, url).  Every
+    other event is (PACKAGE_EVENT, package), yielded once the chunk of text
+    holding the blank line that ends that package's record has been read.
+    
+    Nothing is accumulated beyond a chunk, so this works in constant memory
+    when reading from a pipe.  TLPackage.mirror is not modified.
+    
+    The text is read in chunks of 64 KiB or a few thousand lines, or a
+    record at a time from a pipe, and the complete records in each chunk are split into key lines and their
+    continuation lines with str methods, so plain file lists never go through
+    a Python loop.  A chunk with anything unusual in it is parsed again record
+    by record, and records with comments or carriage returns, or that fail,
+    line by line, so warnings and errors are the same as they always were.
+    Lines from an iterable must keep their line endings, as lines read from a
+    file do.
+    
+    """            
+    
+    for event in _tlpdb_events(flat_tlpdb, allow_partial, first_line, archs, fields):
+        if event[0] is _STOP_EVENT:
+            return
+        yield event
+        
+def _tlpdb_events(flat_tlpdb, allow_partial, first_line, archs, fields):
+    """Does the work of iter_packages_from_tlpdb, yielding (_STOP_EVENT, None) last if it stopped at an error."""
+    
+    if archs is not None:
+        archs = tuple(archs)
+    handlers, docfile_method = _projected_handlers(fields)
+    attribute_cache = {}
+    
+    tlpdb_file = open_tlpdb(flat_tlpdb)
+    lines = tlpdb_file
+    try:
+        read_errors = []
+        whole_records = False
+        start_position = None
+        if not hasattr(lines, "read") or _decompresses(lines):
+            # read ahead line by line, so an error reading, like a truncated
+            # download, is only raised once the lines before it are parsed;
+            # _remaining_lines also picks up where _text_chunks stopped
+            lines = _lines_until_error(lines, read_errors)
+        elif not _is_regular_file(lines):
+            # read(65536) from a pipe waits for all of it, so tlmgr dump-tlpdb
+            # output is taken a record at a time, as its blank lines come in
+            whole_records = True
+        elif hasattr(lines, "tell"):
+            # for reading lines again after a \r; see _remaining_lines
+            start_position = lines.tell()
+        
+        line_idx = first_line
+        pending = ""
+        for chunk, batch in _text_chunks(lines, whole_records):
+            # lines without endings can't be joined, and where lines end around
+            # a \r depends on the file; either way, the rest goes to the line parser
+            if "\r" in chunk or (batch is not None and chunk.count("\n") < len(batch) - 1):
+                remaining = _remaining_lines(pending, chunk, batch, lines, start_position, line_idx - first_line)
+                break
+            
+            text = pending + chunk
+            end = text.rfind("\n\n")
+            if end < 0:
+                pending = text
+                continue
+            # the usual case: every complete record in the chunk at once, unless
+            # the chunk ends in a run of blank lines that split would cut elsewhere
+            if text[end - 1:end] != "\n":
+                try:
+                    packages = _parse_records_text(text[:end], handlers, fields, attribute_cache, archs)
+                except Exception as e:
+                    # parsed again record by record below
+                    pass
+                else:
+                    for package in packages:
+                        yield PACKAGE_EVENT, package
+                    line_idx += text.count("\n", 0, end) + 2
+                    pending = text[end + 2:]
+                    continue
+                
+            records = text.split("\n\n")
+            pending = records.pop()
+            for record_text in records:
+                record_line = line_idx
+                line_idx += record_text.count("\n") + 2
+                try:
+                    packages = _parse_records_text(record_text, handlers, fields, attribute_cache, archs)
+                except Exception as e:
+                    # location-url, comments, stray blank lines and junk, as well
+                    # as errors, go to the line parser
+                    pass
+                else:
+                    for package in packages:
+                        yield PACKAGE_EVENT, package
+                    continue
+                for event in _events_from_lines(_lines_of(record_text + "\n\n"), record_line, allow_partial, handlers, docfile_method, attribute_cache, archs, fields):
+                    yield event
+                    if event[0] is _STOP_EVENT:
+                        return
+        else:
+            # parsed for errors, but a record without a blank line after it is ignored
+            remaining = _lines_of(pending)
+        
+        for event in _events_from_lines(remaining, line_idx, allow_partial, handlers, docfile_method, attribute_cache, archs, fields):
+            yield event
+            if event[0] is _STOP_EVENT:
+                return
+        if read_errors:
+            if not allow_partial or not isinstance(read_errors[0], EOFError):
+                raise read_errors[0]
+            sys.stderr.write("compressed tlpdb is truncated: %s\n" % (read_errors[0]))
+    finally:
+        # a file opened for a path is ours to close
+        if isinstance(flat_tlpdb, _string_types):
+            tlpdb_file.close()
+            
+# yielded by _events_from_lines and _tlpdb_events when they stopped at an
+# error with allow_partial
+_STOP_EVENT = "stop"
+
+# splits records at each line that doesn't start with a space, so every
+# piece is a key line followed by its continuation lines, or an empty piece
+# for the blank line between two records; the text never ends with \n, and a
+# lookahead for a character is quicker than for its absence
+_split_key_lines = re.compile(r"\n(?=[^ ])").split
+
+def _is_regular_file(tlpdb_file):
+    """Returns False for a file that can't seek, like a pipe or a terminal."""
+    seekable = getattr(tlpdb_file, "seekable", None)
+    return seekable is None or seekable()
+    
+def _text_chunks(lines, whole_records=False):
+    """Yields (text, lines) for pieces of a tlpdb a few thousand lines long, cut anywhere.
+    
+    lines is the list the text was joined from, or None if it was read from a file.
+    With whole_records, each piece ends at the next blank line instead, and
+    is yielded as soon as that line has been read.
+    
+    """
+    read = getattr(lines, "read", None)
+    if whole_records:
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if line == "\n":
+                yield "".join(batch), batch
+                batch = []
+        if batch:
+            yield "".join(batch), batch
+    elif read is not None:
+        while True:
+            chunk = read(65536)
+            if not chunk:
+                return
+            yield chunk, None
+    else:
+        from itertools import islice
+        while True:
+            batch = list(islice(lines, 2048))
+            if not batch:
+                return
+            yield "".join(batch), batch
+            
+def _remaining_lines(pending, chunk, batch, lines, start_position, line_count):
+    """Returns the unparsed part of a tlpdb, from pending on, as the lines the file would have given.
+    
+    start_position is where the file was when reading started, and
+    line_count the number of lines before pending.
+    
+    """
+    if batch is not None:
+        # the lines the text was joined from are still around
+        from itertools import chain
+        return chain(_lines_of(pending), batch, lines)
+    if start_position is not None:
+        # Whether a lone \r ends a line depends on how the file was opened,
+        # so its lines are read again.  pending starts a line, and nothing
+        # before it had a \r, so the lines before it end at each \n.
+        from itertools import islice
+        lines.seek(start_position)
+        return islice(lines, line_count, None)
+    # a \r\n could straddle two chunks, so the rest is read at once
+    text = pending + chunk + lines.read()
+    if python_major_version < 3:
+        # Python 2 files only split lines at \n
+        return _lines_of(text)
+    # files that leave \r in the text split lines at \r as well, as StringIO does with newline=""
+    return io.StringIO(text, newline="")
+    
+def _lines_of(text):
+    """Splits text into lines at \\n, keeping the line endings, as a file does."""
+    lines = text.split("\n")
+    last = lines.pop()
+    lines = [line + "\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+    
+def _parse_records_text(text, handlers, fields, attribute_cache, archs):
+    """Parses records separated by single blank lines, without the blank line after the last one.
+    
+    Returns:
+    A list of packages, leaving out those for architectures that weren't asked for.
+    
+    Raises for anything unusual.  The same handlers are called with the same
+    values as by the line parser, in the same order, but errors aren't
+    reported here; the caller parses the records line by line instead.
+    
+    """
+    packages = []
+    record = None
+    for piece in _split_key_lines(text):
+        if record is None:
+            # after a blank line; a second one, like anything else that isn't a name, is unusual
+            if not piece.startswith("name "):
+                raise AssertionError("first line must be a name")
+            record = _RecordParser(attribute_cache, archs)
+        elif not piece:
+            package = record.finish()
+            if package is not None:
+                packages.append(package)
+            record = None
+            continue
+        # most key lines have no continuation lines, and checking is cheaper than partitioning
+        continuation = None
+        if "\n " in piece:
+            piece, ignored, continuation = piece.partition("\n ")
+        key, ignored, value = piece.partition(" ")
+        handler = handlers.get(key)
+        if handler is None:
+            # a comment, or continuation lines after a blank line
+            if not key or key.startswith("#"):
+                raise AssertionError("unexpected line %s" % (piece))
+            handler = _handler_for_key(key, fields)
+            handlers[key] = handler
+        append = handler(record, value)
+        if continuation is not None and append is not _discard_line:
+            values = continuation.split("\n ")
+            owner = getattr(append, "__self__", None)
+            if owner.__class__ is list:
+                # runfiles and srcfiles
+                owner.extend(values)
+                continue
+            for value in values:
+                if append is None:
+                    # continuation of a line that isn't a file list
+                    append = handler(record, value)
+                else:
+                    append(value)
+    if record is not None:
+        package = record.finish()
+        if package is not None:
+            packages.append(package)
+    return packages
+    
+def _events_from_lines(lines, first_line, allow_partial, handlers, docfile_method, attribute_cache, archs, fields):
+    """The line by line parser behind iter_packages_from_tlpdb.
+    
+    Yields the same events, and (_STOP_EVENT, None) if it stopped at an error
+    with allow_partial.
+    
+    """
+    record = None
+    last_key = None
+    # bound append method of the current file list, if any
+    append = None
+    
+    for line_idx, line in enumerate(lines, first_line):
+    
+        first = line[:1]
+        if first == "\r" and line.lstrip("\r")[:1] != "#":
+            # from a file that doesn't end lines at a lone \r; it's stripped
+            # before deciding what the line is, except for comments
+            line = line.lstrip("\r")
+            first = line[:1]
+        
+        # continuation lines are most of the file, and are usually part of a file list
+        if first == " " and append is not None:
+            if append is _discard_line:
+                continue
+            try:
+                append(line.strip("\r\n")[1:])
+            except _BadDocfileLine as e:
+                _skip_docfile_line(line_idx, record, line)
+            continue
+            
+        # comment lines; supported, but not currently used
+        if first == "#":
+            continue
+                
+        line = line.strip("\r\n")
+    
+        if not line:
+            assert record is not None, "Empty line and no package to add. Empty file?"
+            package = record.finish()
+            record = None
+            last_key = None
+            append = None
+            if package is not None:
+                yield PACKAGE_EVENT, package
+            continue
+            
+        try:
+            if first == " ":
+                # continuation of a line that isn't a file list
+                assert record is not None, "first line must be a name"
+                key = last_key
+                value = line[1:]
+            else:
+                # the first space token is a delimiter
+                key, ignored, value = line.partition(" ")
+                if record is None:
+                    # seems to be absent in TL 2020 (not in stderr?)
+                    if line_idx == 0 and line.startswith("location-url\t"):
+                        yield MIRROR_EVENT, line[len("location-url\t"):].strip()
+                        continue
+                    assert key == "name", "first line must be a name"
+                    record = _RecordParser(attribute_cache, archs)
+                    
+            handler = handlers.get(key)
+            if handler is None:
+                # catalogue-* and unhandled keys get a handler the first time
+                # they're seen, so the next record only needs a lookup
+                handler = _handler_for_key(key, fields)
+                handlers[key] = handler
+            append = handler(record, value)
+            last_key = key
+        except _BadDocfileLine as e:
+            _skip_docfile_line(line_idx, record, line)
+            last_key = "docfiles"
+            append = _discard_line if docfile_method is None else getattr(record, docfile_method)
+        except Exception as e:
+            if allow_partial:
+                sys.stderr.write("parsed up to junk line \"%s\"\n" % (line))
+                yield _STOP_EVENT, None
+                return
+            else:
+                raise e
+
+def packages_from_tlpdb(flat_tlpdb, allow_partial=False, compact=False, archs=None, fields=None):
+    """Creates a list of TLPackage objects from the given file-like object.
+    
+    Arguments:
+    flat_tlpdb -- A file or file-like object, open for reading; may be compressed
+    allow_partial -- Pass True if you want to return partial data after an error;
+    useful in case of a partial tlpdb download. Default is to raise an exception.
+    compact -- Pass True to get read-only CompactTLPackage objects instead, for
+    keeping a whole database in memory; this makes the parse about half again
+    as slow, since each package is converted after it's parsed
+    archs -- architectures to keep binaries for; see iter_packages_from_tlpdb
+    fields -- dictionary_value keys to parse; see iter_packages_from_tlpdb
+    
+    Returns:
+    A list of TLPackage objects and a dictionary mapping package name to
+    index in that list.  TLPackage.mirror is set if the tlpdb has a location-url.
+    That's shared by every parse in the process, so use TLDatabase.from_tlpdb,
+    which keeps the mirror with the packages, to parse several tlpdbs at once.
+    
+    """
+    
+    all_packages, index_map, mirror = _parsed_packages(flat_tlpdb, allow_partial, compact, archs, fields)
+    if mirror is not None:
+        TLPackage.mirror = mirror
+    return all_packages, index_map
+    
+def _parsed_packages(flat_tlpdb, allow_partial=False, compact=False, archs=None, fields=None):
+    """packages_from_tlpdb without setting TLPackage.mirror; returns the mirror, or None, as a third value."""
+    all_packages = []
+    index_map = {}
+    mirror = None
+    tables = _CompactionTables() if compact else None
+    # Every package is kept until the end, so the cyclic garbage collector
+    # would only keep scanning a growing pile of live objects; that was
+    # about a sixth of the time for a full tlpdb.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for event, value in iter_packages_from_tlpdb(flat_tlpdb, allow_partial, archs=archs, fields=fields):
+            if event == PACKAGE_EVENT:
+                if tables is not None:
+                    value = CompactTLPackage(value, tables)
+                index_map[value.name] = len(all_packages)
+                all_packages.append(value)
+            else:
+                mirror = value
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+            
+    return all_packages, index_map, mirror
+    
+def _reparsed_package(record_lines, allow_partial, first_line=0):
+    """Parses the lines of a single record, or returns None after an error with allow_partial.
+    
+    first_line is the line number of the record in the tlpdb, so warnings
+    point at the same line a full parse would.
+    
+    """
+    # only the first line of the whole tlpdb can be a location-url
+    if record_lines[0].startswith("location-url\t"):
+        if allow_partial:
+            sys.stderr.write("parsed up to junk line \"%s\"\n" % (record_lines[0].strip("\r\n")))
+            return None
+        raise AssertionError("first line must be a name")
+    for event, value in iter_packages_from_tlpdb(record_lines, allow_partial, first_line):
+        if event == PACKAGE_EVENT:
+            return value
+    return None
+    
+def _record_package(text, line_number, handlers, attribute_cache):
+    """Parses the text of one record that starts with a name line and ends with a single newline.
+    
+    Arguments:
+    text -- the record
+    line_number -- called for the line number of the record, which is only
+    needed for an error
+    handlers, attribute_cache -- from _projected_handlers(None) and an empty
+    dictionary, which can be shared by every record of a tlpdb
+    
+    The record is parsed as a whole, as _tlpdb_events does, and only goes
+    through the line parser if that fails, so an error is raised from there
+    with its line number.
+    
+    """
+    try:
+        packages = _parse_records_text(text[:-1], handlers, None, attribute_cache, None)
+    except Exception as e:
+        packages = None
+    if packages is not None and len(packages) == 1:
+        return packages[0]
+    lines = text.splitlines(True)
+    lines.append("\n")
+    return _reparsed_package(lines, False, line_number())
+    
+def update_packages_from_tlpdb(flat_tlpdb, previous_packages, allow_partial=False):
+    """Parses a tlpdb, reusing packages whose revision hasn't changed since a previous parse.
+    
+    Arguments:
+    flat_tlpdb -- A file or file-like object, open for reading; may be compressed
+    previous_packages -- TLPackage objects from an earlier parse, e.g., of the
+    same repository before it was refreshed
+    allow_partial -- Pass True if you want to return partial data after an error
+    
+    Returns:
+    A list of TLPackage objects and a dictionary mapping package name to index
+    in that list, as packages_from_tlpdb does, a dictionary with "added",
+    "removed" and "changed" lists of package names, and the location-url of
+    the tlpdb, or None.  TLPackage.mirror is not modified.
+    
+    Each record is only searched for its name and revision lines.  If a package of that
+    name and revision was in previous_packages, the rest of the record is
+    skipped and the previous TLPackage is reused, so only new and changed
+    records are parsed.  Records without a revision (00texlive.*) are always
+    parsed, and reported as changed if their contents differ.
+    
+    """
+    
+    previous = dict((pkg.name, pkg) for pkg in previous_packages)
+    all_packages = []
+    index_map = {}
+    added = []
+    changed = []
+    
+    # Finding record boundaries and revision lines with str.find is much
+    # faster than looking at each line, and the whole database has to be in
+    # memory at the end anyway.
+    tlpdb_file = open_tlpdb(flat_tlpdb)
+    lines = tlpdb_file
+    if allow_partial:
+        lines = _lines_until_truncated(lines)
+    try:
+        data = lines.read() if hasattr(lines, "read") else "".join(lines)
+    finally:
+        if isinstance(flat_tlpdb, _string_types):
+            tlpdb_file.close()
+    if "\r" in data:
+        data = data.replace("\r\n", "\n")
+        
+    pos = 0
+    mirror = None
+    if data.startswith("location-url\t"):
+        pos = data.find("\n") + 1
+        mirror = data[len("location-url\t"):pos].strip()
+        
+    # line numbers for warnings; lines are only counted up to records that are parsed
+    counted_pos = 0
+    line_idx = 0
+    while pos < len(data):
+        end = data.find("\n\n", pos)
+        if end == -1:
+            # parsed for errors, but a record without a blank line after it is ignored
+            line_idx += data.count("\n", counted_pos, pos)
+            _reparsed_package(data[pos:].splitlines(True), allow_partial, line_idx)
+            break
+            
+        package = None
+        if data.startswith("name ", pos):
+            name = data[pos + 5:data.find("\n", pos)].strip()
+            old_package = previous.get(name)
+            if old_package is not None:
+                revision_idx = data.find("\nrevision ", pos, end)
+                if revision_idx != -1:
+                    revision_end = data.find("\n", revision_idx + 1)
+                    if str(old_package.revision) == data[revision_idx + 10:revision_end].strip():
+                        package = old_package
+                        
+        if package is None:
+            # stray blank lines are passed along so the parser complains about them
+            record_end = end + 2 if pos != end else end + 1
+            line_idx += data.count("\n", counted_pos, pos)
+            counted_pos = pos
+            package = _reparsed_package(data[pos:record_end].splitlines(True), allow_partial, line_idx)
+            if package is None:
+                break
+            old_package = previous.get(package.name)
+            if old_package is None:
+                added.append(package.name)
+            elif old_package.revision != package.revision or old_package.dictionary_value() != package.dictionary_value():
+                changed.append(package.name)
+                
+        index_map[package.name] = len(all_packages)
+        all_packages.append(package)
+        pos = end + 2
+        
+    removed = [pkg.name for pkg in previous_packages if pkg.name not in index_map]
+    return all_packages, index_map, { "added" : added, "removed" : removed, "changed" : changed }, mirror
+    
+def save_snapshot(packages, path, mirror=None):
+    """Saves packages to path, for update_packages_from_tlpdb in a later run.
+    
+    Packages are stored as marshaled _packed_package tuples, which take about
+    half as long to write and load again as pickled TLPackage attributes.
+    
+    """
+    import marshal
+    snapshot = { "version" : 2, "mirror" : mirror, "fields" : list(_PACKAGE_FIELDS), "packages" : [_packed_package(pkg) for pkg in packages] }
+    with open(path, "wb") as snapshot_file:
+        snapshot_file.write(marshal.dumps(snapshot))
+        
+def load_snapshot(path):
+    """Returns the list of TLPackage objects and the mirror saved by save_snapshot.
+    
+    Raises AssertionError if path isn't a snapshot this version of
+    parse_tlpdb can read.
+    
+    """
+    import marshal
+    # loading creates several objects per package, and none of them are
+    # garbage; see _parsed_packages
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, "rb") as snapshot_file:
+            try:
+                # marshal.load reads a file a few bytes at a time
+                snapshot = marshal.loads(snapshot_file.read())
+            except (ValueError, EOFError, TypeError):
+                raise AssertionError("unsupported snapshot version")
+        assert isinstance(snapshot, dict) and snapshot.get("version") == 2, "unsupported snapshot version"
+        assert snapshot["fields"] == list(_PACKAGE_FIELDS), "snapshot was saved with different TLPackage attributes"
+        packages = [_unpacked_package(values) for values in snapshot["packages"]]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return packages, snapshot["mirror"]
+    
+class MappedTLPackage(TLPackage):
+    """TLPackage whose record stays in a memory-mapped tlpdb until it's needed.
+    
+    Only the name is decoded up front.  Reading any other attribute decodes and
+    parses the record, after which this behaves like any other TLPackage.  If
+    the record can't be parsed, every attribute read raises the parse error.
+    
+    """
+    
+    def __init__(self, source, start, end, name):
+        # TLPackage.__init__ isn't called, since __getattr__ fills everything in
+        object.__init__(self)
+        self._record = (source, start, end)
+        self.name = name
+        
+    def __getattr__(self, attr):
+        # only called for attributes that haven't been set yet
+        location = self.__dict__.get("_record")
+        if location is None or attr.startswith("__"):
+            raise AttributeError(attr)
+        source, start, end = location
+        # _record is only dropped once the record is parsed, so an error is raised again next time
+        package = source.package(start, end)
+        del self.__dict__["_record"]
+        self.__dict__.update(package.__dict__)
+        return getattr(self, attr)
+        
+    def __getstate__(self):
+        # the mapping can't be pickled, so parse the record first
+        if "_record" in self.__dict__:
+            self.category
+        return self.__dict__
+        
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        
+class _LineCounter(object):
+    """Finds the line number at a byte offset of a mapped tlpdb, for warnings from records parsed on demand.
+    
+    Newlines are only counted when a record is parsed, from the nearest offset
+    already looked up, so the mapping isn't copied just to number its lines.
+    
+    """
+    
+    def __init__(self, mapping):
+        super(_LineCounter, self).__init__()
+        self._mapping = mapping
+        self._offsets = [0]
+        self._lines = [0]
+        
+    def line_at(self, offset):
+        import bisect
+        idx = bisect.bisect_right(self._offsets, offset) - 1
+        line = self._lines[idx] + self._mapping[self._offsets[idx]:offset].count(b"\n")
+        if self._offsets[idx] != offset:
+            self._offsets.insert(idx + 1, offset)
+            self._lines.insert(idx + 1, line)
+        return line
+        
+class _MappedRecords(object):
+    """The memory-mapped tlpdb behind MappedTLPackage objects; unmapped by close, or once none of them are left."""
+    
+    def __init__(self, mapping):
+        super(_MappedRecords, self).__init__()
+        self._mapping = mapping
+        self.line_at = _LineCounter(mapping).line_at
+        self._handlers = _projected_handlers(None)[0]
+        self._attribute_cache = {}
+        
+    def package(self, start, end):
+        """Parses the record between two byte offsets."""
+        if self._mapping is None:
+            raise ValueError("mapped tlpdb is closed")
+        text = self._mapping[start:end].decode("utf-8")
+        return _record_package(text, lambda: self.line_at(start), self._handlers, self._attribute_cache)
+        
+    def close(self):
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+            
+    def __del__(self):
+        self.close()
+        
+def close_mapped_packages(packages):
+    """Unmaps the tlpdb behind packages from packages_from_mapped_tlpdb.
+    
+    Packages whose records were already parsed are unaffected; reading any
+    other attribute of the rest raises ValueError.  Without this, the tlpdb
+    stays mapped as long as any of its packages exist.
+    
+    """
+    for package in packages:
+        location = package.__dict__.get("_record")
+        if location is not None:
+            location[0].close()
+            
+def packages_from_mapped_tlpdb(path, allow_partial=False):
+    """Creates a list of TLPackage objects from a tlpdb file, without decoding most of it.
+    
+    Arguments:
+    path -- path to an uncompressed tlpdb; compressed files are passed to
+    packages_from_tlpdb instead
+    allow_partial -- Pass True if you want to return partial data after an
+    error; every record is then parsed up front, since the packages before
+    the first error are only known once each record has been parsed
+    
+    Returns:
+    A list of TLPackage objects and a dictionary mapping package name to
+    index in that list, as from packages_from_tlpdb, and the location-url of
+    the tlpdb, or None.  TLPackage.mirror is not modified.
+    
+    The file is memory mapped and split into records with bytes.find, and
+    each package keeps the offsets of its record.  Records are read, decoded
+    and parsed the first time a field other than the name is read, so a
+    caller that only needs some packages, or only their names, never pays for
+    the rest.  Without allow_partial, errors in a record only show up when
+    it's parsed, as a ValueError or AssertionError from the first attribute
+    read; records that don't start with a name line are parsed right away.
+    See close_mapped_packages for unmapping the file.
+    
+    """
+    
+    import mmap
+    with open(path, "rb") as tlpdb_file:
+        if _decompressor_for(tlpdb_file.read(6)) is not None:
+            tlpdb_file.seek(0)
+            return _parsed_packages(tlpdb_file, allow_partial)
+        try:
+            mapping = mmap.mmap(tlpdb_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            # can't map an empty file
+            return _parsed_packages(path, allow_partial)
+            
+    # records are split on \n\n, and text mode splits lines on \r, so leave those files to the parser
+    if mapping.find(b"\r") != -1:
+        mapping.close()
+        return _parsed_packages(path, allow_partial)
+            
+    # the mapping can't be closed while a memoryview of it is around, so
+    # packages keep offsets and this view goes away at the end
+    view = memoryview(mapping)
+    source = _MappedRecords(mapping)
+    size = len(mapping)
+    all_packages = []
+    index_map = {}
+    
+    try:
+        pos = 0
+        mirror = None
+        if mapping[:13] == b"location-url\t":
+            pos = mapping.find(b"\n") + 1
+            mirror = str(view[13:pos], "utf-8").strip()
+            
+        while pos < size:
+            end = mapping.find(b"\n\n", pos)
+            if end == -1:
+                # parsed for errors, but a record without a blank line after it is ignored
+                _reparsed_package(str(view[pos:], "utf-8").splitlines(True), allow_partial, source.line_at(pos))
+                break
+            name_end = mapping.find(b"\n", pos)
+            if mapping[pos:pos + 5] == b"name " and not allow_partial:
+                package = MappedTLPackage(source, pos, end + 1, str(view[pos + 5:name_end], "utf-8").strip())
+            else:
+                # stray blank lines and comments go through the parser right away
+                record_end = end + 2 if pos != end else end + 1
+                package = _reparsed_package(str(view[pos:record_end], "utf-8").splitlines(True), allow_partial, source.line_at(pos))
+                if package is None:
+                    break
+            index_map[package.name] = len(all_packages)
+            all_packages.append(package)
+            pos = end + 2
+    finally:
+        view.release()
+        
+    return all_packages, index_map, mirror
+    
+def _has_carriage_return(tlpdb_file):
+    """Returns True if a file opened in binary mode contains \\r anywhere."""
+    import mmap
+    try:
+        mapping = mmap.mmap(tlpdb_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError as e:
+        # empty file
+        return False
+    try:
+        return mapping.find(b"\r") != -1
+    finally:
+        mapping.close()
+        
+class _RecordSource(object):
+    """Reads and parses records of a tlpdb file for LazyTLPackage, keeping it open between reads.
+    
+    Reads may come from any thread.  The size and modification time of the
+    file are checked against those it had when it was split into records.
+    
+    """
+    
+    def __init__(self, path, stat):
+        super(_RecordSource, self).__init__()
+        import threading
+        self.path = path
+        self._stat = (stat.st_size, stat.st_mtime)
+        self._file = None
+        self._lock = threading.Lock()
+        self._handlers = _projected_handlers(None)[0]
+        self._attribute_cache = {}
+        
+    def read(self, start, end):
+        import os
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "rb")
+            stat = os.fstat(self._file.fileno())
+            assert (stat.st_size, stat.st_mtime) == self._stat, "%s changed since it was read" % (self.path)
+            self._file.seek(start)
+            return self._file.read(end - start)
+            
+    def package(self, start, end):
+        """Parses the record between two byte offsets."""
+        line_number = lambda: self.read(0, start).count(b"\n")
+        return _record_package(self.read(start, end).decode("utf-8"), line_number, self._handlers, self._attribute_cache)
+        
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            
+    def __del__(self):
+        self.close()
+        
+class LazyTLPackage(TLPackage):
+    """TLPackage that reads its file lists from the tlpdb when they're first used.
+    
+    Everything but the attributes in LAZY_ATTRIBUTES is parsed up front.  The
+    first time one of those is read, the record is read again from its byte
+    offsets in the tlpdb file and all of them are filled in.  The file must
+    not change in the meantime; if its size or modification time did, an
+    AssertionError is raised instead.
+    
+    """
+    
+    LAZY_ATTRIBUTES = ("runfiles", "srcfiles", "docfiles", "docfiledata", "binfiles", "cataloguedata", "extradata")
+    
+    def __getattr__(self, attr):
+        # only called for attributes that haven't been set yet
+        location = self.__dict__.get("_location")
+        if location is None or attr not in LazyTLPackage.LAZY_ATTRIBUTES:
+            raise AttributeError(attr)
+        source, start, end = location
+        # _location is only dropped once the record is parsed, so an error is raised again next time
+        package = source.package(start, end)
+        assert package.name == self.name, "tlpdb changed since %s was read" % (self.name)
+        del self.__dict__["_location"]
+        for key in LazyTLPackage.LAZY_ATTRIBUTES:
+            setattr(self, key, getattr(package, key))
+        return getattr(self, attr)
+        
+    def __getstate__(self):
+        # the source file isn't pickled, so load everything first
+        if "_location" in self.__dict__:
+            self.runfiles
+        return self.__dict__
+        
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        
+# dictionary_value keys of LazyTLPackage.LAZY_ATTRIBUTES, which lazy_packages_from_tlpdb doesn't parse
+_LAZY_FIELDS = frozenset(("runFiles", "sourceFiles", "docFiles", "docFileData", "binFiles", "catalogueData", "extradata"))
+_FILE_LIST_KEYS = frozenset(("runfiles", "srcfiles", "docfiles", "binfiles"))
+
+def _record_header(text):
+    """Returns the text of a record without the lines lazy_packages_from_tlpdb leaves in the file."""
+    kept = []
+    for piece in _split_key_lines(text):
+        key = piece.partition("\n")[0].partition(" ")[0]
+        if key in _FILE_LIST_KEYS:
+            # the key line has the sizes; the paths are on continuation lines
+            kept.append(piece.partition("\n")[0])
+        elif key in _KEY_HANDLERS or key[:1] == "#":
+            kept.append(piece)
+    return "\n".join(kept)
+    
+def lazy_packages_from_tlpdb(path, allow_partial=False):
+    """Creates a list of LazyTLPackage objects, leaving file lists in the tlpdb until they're used.
+    
+    Arguments:
+    path -- path to an uncompressed tlpdb; compressed files are read with
+    packages_from_tlpdb instead, since they can't be read at an offset
+    allow_partial -- Pass True if you want to return partial data after an error
+    
+    Returns:
+    A list of TLPackage objects and a dictionary mapping package name to
+    index in that list, as from packages_from_tlpdb, and the location-url of
+    the tlpdb, or None.  TLPackage.mirror is not modified.
+    
+    Continuation lines, which hold the runfiles, srcfiles, docfiles and
+    binfiles and are most of the file, catalogue-* lines and keys that end up
+    in extradata (container sizes and checksums) are skipped, as they are
+    for iter_packages_from_tlpdb fields that leave them out; each package
+    only keeps the byte offsets of its record.  Sizes, depends and the other
+    keyed lines are parsed as usual, so the package list, update list and
+    anything else that shows names, revisions and descriptions never loads
+    the file lists.  Records that don't start with a name line are parsed in
+    full right away.
+    
+    """
+    
+    import mmap
+    import os
+    with open(path, "rb") as tlpdb_file:
+        if _decompressor_for(tlpdb_file.read(6)) is not None:
+            tlpdb_file.seek(0)
+            return _parsed_packages(tlpdb_file, allow_partial)
+        # offsets into a text mode file, which splits lines on \r, wouldn't be byte offsets
+        if _has_carriage_return(tlpdb_file):
+            return _parsed_packages(path, allow_partial)
+        try:
+            mapping = mmap.mmap(tlpdb_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            # can't map an empty file
+            return _parsed_packages(path, allow_partial)
+        source = _RecordSource(path, os.fstat(tlpdb_file.fileno()))
+        
+    fields = [field for field in PACKAGE_FIELDS if field not in _LAZY_FIELDS]
+    handlers = _projected_handlers(fields)[0]
+    attribute_cache = {}
+    line_counter = _LineCounter(mapping)
+    size = len(mapping)
+    all_packages = []
+    index_map = {}
+    
+    # see _parsed_packages
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        pos = 0
+        mirror = None
+        if mapping[:13] == b"location-url\t":
+            pos = mapping.find(b"\n") + 1
+            mirror = mapping[13:pos].decode("utf-8").strip()
+            
+        stopped = False
+        while pos < size and not stopped:
+            # a run of records that start with a name line, parsed together as _tlpdb_events does
+            batch = []
+            batch_start = pos
+            while pos < size and len(batch) < 256 and mapping[pos:pos + 5] == b"name ":
+                end = mapping.find(b"\n\n", pos)
+                if end == -1:
+                    break
+                batch.append((pos, end))
+                pos = end + 2
+            if batch:
+                try:
+                    packages = _parse_records_text(mapping[batch_start:batch[-1][1]].decode("utf-8"), handlers, fields, attribute_cache, None)
+                except Exception as e:
+                    packages = None
+                if packages is None or len(packages) != len(batch):
+                    # the line parser reports errors, without the lines that
+                    # are left in the file; line numbers within a record are
+                    # off by those
+                    packages = []
+                    for start, end in batch:
+                        package = _reparsed_package(_lines_of(_record_header(mapping[start:end].decode("utf-8")) + "\n\n"), allow_partial, line_counter.line_at(start))
+                        if package is None:
+                            stopped = True
+                            break
+                        packages.append(package)
+                for package, (start, end) in zip(packages, batch):
+                    package.__class__ = LazyTLPackage
+                    for key in LazyTLPackage.LAZY_ATTRIBUTES:
+                        delattr(package, key)
+                    package._location = (source, start, end + 1)
+                    index_map[package.name] = len(all_packages)
+                    all_packages.append(package)
+                continue
+                
+            end = mapping.find(b"\n\n", pos)
+            if end == -1:
+                # parsed for errors, but a record without a blank line after it is ignored
+                _reparsed_package(mapping[pos:].decode("utf-8").splitlines(True), allow_partial, line_counter.line_at(pos))
+                break
+            # stray blank lines and comments go through the parser right away
+            record_end = end + 2 if pos != end else end + 1
+            package = _reparsed_package(mapping[pos:record_end].decode("utf-8").splitlines(True), allow_partial, line_counter.line_at(pos))
+            if package is None:
+                break
+            index_map[package.name] = len(all_packages)
+            all_packages.append(package)
+            pos = end + 2
+    finally:
+        mapping.close()
+        if gc_was_enabled:
+            gc.enable()
+            
+    return all_packages, index_map, mirror
+    
+# TLPackage attributes, in the order _packed_package and _unpacked_package use
+_PACKAGE_FIELDS = tuple(TLPackage().__dict__)
+_FILE_LIST_FIELDS = frozenset(("runfiles", "srcfiles", "docfiles"))
+
+def _packed_package(package):
+    """Returns the attributes of a TLPackage as a tuple of builtin types, which marshal handles.
+    
+    File lists are joined with newlines, which can't occur in a path, since
+    one string is much cheaper to send and load than thousands of short ones.
+    
+    """
+    state = package.__dict__
+    values = []
+    for field in _PACKAGE_FIELDS:
+        value = state[field]
+        # None for an empty list, so [""] survives the round trip
+        if field in _FILE_LIST_FIELDS:
+            value = "\n".join(value) if value else None
+        elif field == "binfiles":
+            value = dict((arch, "\n".join(value[arch]) if value[arch] else None) for arch in value)
+        values.append(value)
+    return tuple(values)
+    
+# positions in a _packed_package tuple of the values that need splitting again
+_FILE_LIST_INDEXES = tuple(idx for idx, field in enumerate(_PACKAGE_FIELDS) if field in _FILE_LIST_FIELDS)
+_BINFILES_INDEX = _PACKAGE_FIELDS.index("binfiles")
+
+def _unpacked_package(values):
+    package = TLPackage.__new__(TLPackage)
+    values = list(values)
+    for idx in _FILE_LIST_INDEXES:
+        value = values[idx]
+        values[idx] = [] if value is None else value.split("\n")
+    binfiles = values[_BINFILES_INDEX]
+    if binfiles:
+        values[_BINFILES_INDEX] = dict((arch, [] if binfiles[arch] is None else binfiles[arch].split("\n")) for arch in binfiles)
+    package.__dict__.update(zip(_PACKAGE_FIELDS, values))
+    return package
+    
+def _parse_tlpdb_range(path, start, end, first_line, allow_partial, archs, fields):
+    """Parses the records between two byte offsets of a tlpdb; runs in a worker process.
+    
+    Returns:
+    The mirror, or None, True if the whole range was parsed without stopping
+    at an error, the packages as a marshal string of _packed_package tuples,
+    and the number of lines in the range.  A marshal string is a small
+    fraction of the size of a pickled TLPackage list, and much faster to load.
+    
+    """
+    import marshal
+    with open(path, "rb") as tlpdb_file:
+        tlpdb_file.seek(start)
+        lines = tlpdb_file.read(end - start).decode("utf-8").splitlines(True)
+    mirror = None
+    complete = True
+    values = []
+    # the parser reads ahead, so what's left of the lines can't tell whether
+    # it stopped at an error; the stop event can
+    for event, value in _tlpdb_events(lines, allow_partial, first_line, archs, fields):
+        if event == PACKAGE_EVENT:
+            values.append(_packed_package(value))
+        elif event is _STOP_EVENT:
+            complete = False
+        else:
+            mirror = value
+    return mirror, complete, marshal.dumps(values), len(lines)
+    
+def _record_boundaries(path, jobs):
+    """Returns a list of (start, end, first_line) tuples splitting a tlpdb into about jobs pieces at blank lines."""
+    import mmap
+    import os
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as tlpdb_file:
+        mapping = mmap.mmap(tlpdb_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            first_line = 0
+            for idx in range(1, jobs + 1):
+                if idx == jobs:
+                    end = size
+                else:
+                    end = mapping.find(b"\n\n", max(start, size * idx // jobs))
+                    end = size if end == -1 else end + 2
+                if end > start:
+                    ranges.append((start, end, first_line))
+                    first_line += mapping[start:end].count(b"\n")
+                    start = end
+        finally:
+            mapping.close()
+    return ranges
+    
+def _can_parse_in_parallel(path, jobs):
+    """Returns False if parallel_packages_from_tlpdb would parse path in this process."""
+    if jobs < 2:
+        return False
+    with open(path, "rb") as tlpdb_file:
+        magic = tlpdb_file.read(6)
+        # an empty file can't be mapped to find record boundaries
+        return bool(magic) and _decompressor_for(magic) is None and not _has_carriage_return(tlpdb_file)
+    
+def parallel_packages_from_tlpdb(path, jobs, allow_partial=False, archs=None, fields=None):
+    """Creates a list of TLPackage objects from a tlpdb file, using several processes.
+    
+    Arguments:
+    path -- path to a tlpdb; compressed or empty files, files with \\r line
+    endings and jobs less than 2 are handled by packages_from_tlpdb in this process
+    jobs -- number of worker processes
+    allow_partial -- Pass True if you want to return partial data after an error
+    archs -- architectures to keep binaries for; see iter_packages_from_tlpdb
+    fields -- dictionary_value keys to parse; see iter_packages_from_tlpdb
+    
+    Returns:
+    The same list of TLPackage objects and index dictionary as
+    packages_from_tlpdb, in the same order, and the location-url of the
+    tlpdb, or None.  TLPackage.mirror is not modified.
+    
+    The file is split at blank lines, which always separate records, into a
+    few pieces per worker.  Workers send packages back as marshaled tuples
+    instead of pickled objects, since IPC would otherwise eat most of the
+    gain, and this process unpacks each piece while the workers are still
+    parsing later ones.  With allow_partial, packages after the first error
+    are dropped, as a serial parse would never see them; otherwise the first
+    error in file order is raised.
+    
+    """
+    
+    if not _can_parse_in_parallel(path, jobs):
+        with open_tlpdb(path) as flat_tlpdb:
+            return _parsed_packages(flat_tlpdb, allow_partial, archs=archs, fields=fields)
+    return _parallel_parse(path, jobs, allow_partial, archs, fields)[:3]
+    
+# pieces per worker; more overlap unpacking with parsing, at a small cost per piece
+_PIECES_PER_JOB = 4
+
+def _parallel_parse(path, jobs, allow_partial, archs, fields):
+    """parallel_packages_from_tlpdb for a file _can_parse_in_parallel accepts; returns the lines parsed as a fourth value."""
+    import marshal
+    from concurrent.futures import ProcessPoolExecutor
+    
+    all_packages = []
+    index_map = {}
+    tlpdb_mirror = None
+    line_count = 0
+    ranges = _record_boundaries(path, jobs * _PIECES_PER_JOB)
+    # unpacking allocates a few objects for every line, and the collector
+    # would keep scanning all the packages so far; see _parsed_packages
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as executor:
+            futures = [executor.submit(_parse_tlpdb_range, path, start, end, first_line, allow_partial, archs, fields) for start, end, first_line in ranges]
+            for future in futures:
+                mirror, complete, payload, lines = future.result()
+                line_count += lines
+                if mirror is not None:
+                    tlpdb_mirror = mirror
+                for values in marshal.loads(payload):
+                    package = _unpacked_package(values)
+                    index_map[package.name] = len(all_packages)
+                    all_packages.append(package)
+                if not complete:
+                    for remaining in futures:
+                        remaining.cancel()
+                    break
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+                
+    return all_packages, index_map, tlpdb_mirror, line_count
+    
+def host_platform():
+    """Returns the TeX Live name of this machine's platform, e.g. universal-darwin or x86_64-linux.
+    
+    This follows tlmgr's platform detection for the common cases; anything
+    else gets cpu-system, which may not name a real TeX Live platform.
+    
+    """
+    import platform
+    system = platform.system().lower()
+    machine = platform.machine().lower()
+    if system == "darwin":
+        version = tuple(_leading_integer(part) or 0 for part in platform.mac_ver()[0].split("."))
+        return "x86_64-darwinlegacy" if version < (10, 14) else "universal-darwin"
+    if system == "windows":
+        return "windows"
+    if machine in ("x86_64", "amd64"):
+        cpu = "amd64" if system in ("freebsd", "netbsd") else "x86_64"
+    elif machine in ("aarch64", "arm64"):
+        cpu = "aarch64"
+    elif machine.startswith("arm"):
+        cpu = "armhf"
+    elif re.match(r"i\d86$", machine):
+        cpu = "i386"
+    else:
+        cpu = machine
+    if system.startswith("cygwin"):
+        system = "cygwin"
+    elif system == "sunos":
+        system = "solaris"
+    return "%s-%s" % (cpu, system)
+    
+def _leading_integer(value):
+    """Returns the integer at the start of value, as NSScanner would, or None."""
+    match = re.match(r"\s*([+-]?\d+)", value)
+    return int(match.group(1)) if match else None
+    
+def header_from_tlpdb(flat_tlpdb, allow_partial=False):
+    """Reads only the repository settings at the start of a tlpdb.
+    
+    Arguments:
+    flat_tlpdb -- A path, or a file or file-like object open for reading; may be compressed
+    allow_partial -- Pass True to return whatever was found after an error,
+    e.g., when only the first few kilobytes of a remote tlpdb were downloaded
+    
+    Returns:
+    A dictionary with these keys, each of which is missing if the tlpdb
+    doesn't specify it:
+    
+    mirror -- the location-url written by tlmgr dump-tlpdb
+    release -- the TeX Live year this database is for (an int)
+    official -- False if the release has a suffix, as unofficial repositories do
+    minrelease -- the oldest TeX Live year this database supports (an int)
+    frozen -- True if the repository is frozen for the year
+    revision -- the repository revision (an int)
+    config -- every other setting in 00texlive.config, as strings
+    options -- the opt_ settings from 00texlive.installation, as strings
+    settings -- the setting_ values from 00texlive.installation, as strings
+    
+    The 00texlive.* records are the first ones in a tlpdb, so reading stops
+    as soon as 00texlive.config and 00texlive.installation have been parsed,
+    or at the first package that isn't one of them.  That's after the first
+    64 KiB of an uncompressed tlpdb, or the first few thousand lines of a
+    compressed one.
+    
+    """
     
-    Returns:
-    A dictionary of attributes
+    header = {}
+    found = set()
+    events = iter_packages_from_tlpdb(flat_tlpdb, allow_partial)
+    try:
+        for event, value in events:
+            if event == MIRROR_EVENT:
+                header["mirror"] = value
+                continue
+            
+            if value.name == "00texlive.config":
+                config = {}
+                for dep in value.depends:
+                    key, ignored, setting = dep.partition("/")
+                    if key == "release":
+                        header["release"] = _leading_integer(setting)
+                        header["official"] = setting.strip().isdigit()
+                    elif key in ("minrelease", "revision"):
+                        header[key] = _leading_integer(setting)
+                    elif key == "frozen":
+                        header["frozen"] = setting.strip() not in ("", "0")
+                    else:
+                        config[key] = setting
+                header["config"] = config
+            elif value.name == "00texlive.installation":
+                options = {}
+                settings = {}
+                for dep in value.depends:
+                    key, ignored, setting = dep.partition(":")
+                    if key.startswith("opt_"):
+                        options[key[4:]] = setting
+                    elif key.startswith("setting_"):
+                        settings[key[8:]] = setting
+                header["options"] = options
+                header["settings"] = settings
+            elif not value.name.startswith("00texlive."):
+                break
+            
+            found.add(value.name)
+            if "00texlive.config" in found and "00texlive.installation" in found:
+                break
+    finally:
+        # stops reading, and closes the file if flat_tlpdb was a path
+        events.close()
+        
+    return dict((key, value) for key, value in header.items() if value is not None)
     
-    Example input lines:
+class FileOwnerIndex(object):
+    """Reverse index from installed file path to owning package name(s).
     
-        arch=x86_64-darwin size=1
-        details="Package introduction" language="de"
-        RELOC/doc/platex/pxbase/README details="Readme" language="ja"
+    Covers runfiles, srcfiles, docfiles and binfiles for every architecture.
+    Paths in a remote tlpdb start with RELOC/ for relocatable packages, which
+    tlmgr installs under texmf-dist/, so they're stored that way; lookups
+    accept either form.  Exact lookups are a dictionary access.  Prefix and
+    basename lookups use a sorted path list and a basename map, which are
+    built the first time they're needed.
     
     """
     
-    key = None
-    value = None
-    chars = []
-    quote_count = 0
-    attrs = {}
-    for c in line:
-
-        if c == "=":
+    def __init__(self):
+        super(FileOwnerIndex, self).__init__()
+        # maps path to a package name, or a tuple of names for the rare shared file
+        self._owners = {}
+        self._sorted_paths = None
+        self._basenames = None
+        
+    @staticmethod
+    def normalized_path(path):
+        """Returns path as it's installed, i.e., with RELOC/ replaced by texmf-dist/."""
+        if path.startswith("RELOC/"):
+            return "texmf-dist/" + path[len("RELOC/"):]
+        return path
+        
+    def add_package(self, package):
+        """Adds all files of a TLPackage.  Packages can be added in any order."""
+        owners = self._owners
+        name = package.name
+        file_lists = [package.runfiles, package.srcfiles, package.docfiles]
+        file_lists += [package.binfiles[arch] for arch in package.binfiles]
+        for files in file_lists:
+            for path in files:
+                if path.startswith("RELOC/"):
+                    path = "texmf-dist/" + path[6:]
+                existing = owners.get(path)
+                if existing is None:
+                    owners[path] = name
+                elif isinstance(existing, tuple):
+                    if name not in existing:
+                        owners[path] = existing + (name,)
+                elif existing != name:
+                    owners[path] = (existing, name)
+        self._sorted_paths = None
+        self._basenames = None
+        
+    def add_packages(self, packages):
+        """Adds each TLPackage in an iterable, yielding it afterwards.
+        
+        This lets the index be built in the same pass as writing the packages:
+        
+            _save_as_plist(index.add_packages(packages), path)
+            
+        """
+        for package in packages:
+            self.add_package(package)
+            yield package
             
-            if key == None:
-                assert quote_count == 0, "possibly quoted key in line %s" % (line)
-                key = "".join(chars)
-                chars = []
+    def __len__(self):
+        return len(self._owners)
+        
+    def __contains__(self, path):
+        return self.normalized_path(path) in self._owners
+        
+    def _owner_list(self, owner):
+        return list(owner) if isinstance(owner, tuple) else [owner]
+        
+    def owners(self, path):
+        """Returns a list of names of the packages that own path, which is empty if none do."""
+        owner = self._owners.get(self.normalized_path(path))
+        return [] if owner is None else self._owner_list(owner)
+        
+    def paths_with_prefix(self, prefix):
+        """Returns a sorted list of (path, owner names) for every path starting with prefix."""
+        import bisect
+        if self._sorted_paths is None:
+            self._sorted_paths = sorted(self._owners)
+        prefix = self.normalized_path(prefix)
+        paths = self._sorted_paths
+        results = []
+        for idx in range(bisect.bisect_left(paths, prefix), len(paths)):
+            path = paths[idx]
+            if not path.startswith(prefix):
+                break
+            results.append((path, self._owner_list(self._owners[path])))
+        return results
+        
+    def paths_with_basename(self, basename):
+        """Returns a list of (path, owner names) for every path whose last component is basename."""
+        if self._basenames is None:
+            basenames = {}
+            for path in self._owners:
+                key = path.rpartition("/")[2]
+                if key in basenames:
+                    basenames[key].append(path)
+                else:
+                    basenames[key] = [path]
+            self._basenames = basenames
+        return [(path, self._owner_list(self._owners[path])) for path in self._basenames.get(basename, ())]
+        
+    def save(self, path_or_file):
+        """Writes the index as sorted lines of path, a tab, and space-separated package names."""
+        should_close = not hasattr(path_or_file, "write")
+        output_file = open(path_or_file, "w") if should_close else path_or_file
+        try:
+            if self._sorted_paths is None:
+                self._sorted_paths = sorted(self._owners)
+            owners = self._owners
+            for path in self._sorted_paths:
+                owner = owners[path]
+                output_file.write("%s\t%s\n" % (path, " ".join(owner) if isinstance(owner, tuple) else owner))
+        finally:
+            if should_close:
+                output_file.close()
+                
+    @classmethod
+    def load(cls, path_or_file):
+        """Reads an index written by save()."""
+        index = cls()
+        should_close = not hasattr(path_or_file, "read")
+        input_file = open(path_or_file, "r") if should_close else path_or_file
+        try:
+            owners = index._owners
+            sorted_paths = []
+            for line in input_file:
+                path, ignored, names = line.rstrip("\n").partition("\t")
+                owners[path] = tuple(names.split(" ")) if " " in names else names
+                sorted_paths.append(path)
+        finally:
+            if should_close:
+                input_file.close()
+        index._sorted_paths = sorted_paths
+        return index
+        
+try:
+    from types import MappingProxyType as _MappingProxyType
+except ImportError:
+    # Python 2 has no read-only dictionary view, so callers get a copy
+    _MappingProxyType = dict
+    
+class TLDatabase(object):
+    """Packages from one tlpdb, with indexes for the lookups every consumer needs.
+    
+    Arguments:
+    packages -- an iterable of TLPackage objects (or CompactTLPackage or
+    LazyTLPackage objects), in tlpdb order
+    mirror -- the location-url of the tlpdb, if any
+    
+    The indexes are built once, here: by name, by category, by architecture
+    for packages with binaries, and for packages with execute or postaction
+    entries.  Lookups are dictionary accesses, and everything returned is a
+    tuple or a read-only mapping, so it can be shared without copying.  As
+    with the index dictionary from packages_from_tlpdb, the last package of a
+    name wins if a tlpdb has duplicates.  Architectures come from binsize,
+    which is always parsed, so building the indexes doesn't load a
+    LazyTLPackage's file lists.
+    
+    """
+    
+    def __init__(self, packages, mirror=None):
+        super(TLDatabase, self).__init__()
+        self.mirror = mirror
+        self._packages = tuple(packages)
+        by_name = {}
+        categories = {}
+        archs = {}
+        executes = []
+        postactions = []
+        for package in self._packages:
+            by_name[package.name] = package
+            if package.category in categories:
+                categories[package.category].append(package)
             else:
-                chars.append(c)
+                categories[package.category] = [package]
+            for arch in package.binsize:
+                if arch in archs:
+                    archs[arch].append(package)
+                else:
+                    archs[arch] = [package]
+            if package.executes:
+                executes.append(package)
+            if package.postactions:
+                postactions.append(package)
+        self._by_name = by_name
+        self._categories = dict((category, tuple(members)) for category, members in categories.items())
+        self._archs = dict((arch, tuple(members)) for arch, members in archs.items())
+        self._executes = tuple(executes)
+        self._postactions = tuple(postactions)
+        
+    @classmethod
+    def from_tlpdb(cls, flat_tlpdb, allow_partial=False, compact=False, archs=None, fields=None):
+        """Parses a tlpdb into a TLDatabase; arguments are as for packages_from_tlpdb."""
+        packages, index_map, mirror = _parsed_packages(flat_tlpdb, allow_partial, compact, archs, fields)
+        return cls(packages, mirror)
+        
+    def __len__(self):
+        return len(self._packages)
+        
+    def __iter__(self):
+        return iter(self._packages)
+        
+    def __contains__(self, name):
+        return name in self._by_name
+        
+    def __getitem__(self, name):
+        """Returns the package named name; raises KeyError if there isn't one."""
+        return self._by_name[name]
         
-        elif c == "\"":
+    def get(self, name, default=None):
+        """Returns the package named name, or default."""
+        return self._by_name.get(name, default)
+        
+    @property
+    def packages(self):
+        """All packages, as a tuple in tlpdb order."""
+        return self._packages
+        
+    @property
+    def by_name(self):
+        """Read-only mapping of package name to package."""
+        return _MappingProxyType(self._by_name)
+        
+    def categories(self):
+        """Returns a sorted list of the categories in the database."""
+        return sorted(category for category in self._categories if category is not None)
+        
+    def packages_in_category(self, category):
+        """Returns a tuple of the packages in category, e.g., "Collection", in tlpdb order."""
+        return self._categories.get(category, ())
+        
+    def archs(self):
+        """Returns a sorted list of the architectures any package has binaries for."""
+        return sorted(self._archs)
+        
+    def packages_with_binaries(self, arch):
+        """Returns a tuple of the packages with binfiles for arch, in tlpdb order."""
+        return self._archs.get(arch, ())
+        
+    def has_binaries(self, name, arch):
+        """Returns True if the package named name has binfiles for arch."""
+        package = self._by_name.get(name)
+        return package is not None and arch in package.binsize
+        
+    def packages_with_executes(self):
+        """Returns a tuple of the packages with execute entries, such as AddFormat, in tlpdb order."""
+        return self._executes
+        
+    def packages_with_postactions(self):
+        """Returns a tuple of the packages with postaction entries, in tlpdb order."""
+        return self._postactions
+        
+class PinningRules(object):
+    """tlmgr's pinning file, which says which repository packages come from.
+    
+    Arguments:
+    lines -- an iterable of lines from tlpkg/pinning.txt, each one of the
+    form repository_tag:pattern[,pattern...][:options]
+    
+    Patterns are shell globs matched against package names.  The first line
+    with a matching pattern wins.  Blank lines and lines starting with # are
+    ignored, and so are the options, which tlmgr uses for revision ranges.
+    
+    """
+    
+    def __init__(self, lines=()):
+        super(PinningRules, self).__init__()
+        self.rules = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            tag, sep, rest = line.partition(":")
+            assert sep and tag.strip(), "bad pinning line %s" % (line)
+            patterns = [pattern.strip() for pattern in rest.partition(":")[0].split(",") if pattern.strip()]
+            self.rules.append((tag.strip(), patterns))
             
-            quote_count += 1
+    @classmethod
+    def load(cls, path):
+        """Reads the rules from a pinning file."""
+        with open(path, "r") as pinning_file:
+            return cls(pinning_file)
             
-        elif c == " ":
+    def repository_for(self, name):
+        """Returns the tag of the repository name is pinned to, or None."""
+        from fnmatch import fnmatchcase
+        for tag, patterns in self.rules:
+            for pattern in patterns:
+                if fnmatchcase(name, pattern):
+                    return tag
+        return None
+        
+class MergedTLDatabase(TLDatabase):
+    """Packages chosen from several repositories, as tlmgr would install them.
+    
+    Arguments:
+    repositories -- a list of (tag, TLDatabase) pairs; the order breaks ties
+    pinning -- PinningRules, or None
+    main -- tag of the main repository
+    
+    Each package comes from the repository it's pinned to, if that repository
+    has it; otherwise from the main repository, if it has it; otherwise from
+    the repository with the highest revision.  The 00texlive.* records and
+    the mirror are the main repository's.  Use repository() to find where a
+    package came from.
+    
+    """
+    
+    def __init__(self, repositories, pinning=None, main="main"):
+        by_tag = dict(repositories)
+        assert len(by_tag) == len(repositories), "repository tags must be unique"
+        names = []
+        seen = set()
+        for tag, database in repositories:
+            for package in database:
+                if package.name not in seen:
+                    seen.add(package.name)
+                    names.append(package.name)
+        main_database = by_tag.get(main)
+        
+        packages = []
+        provenance = {}
+        for name in names:
+            tag = None
+            if name.startswith("00texlive."):
+                # repository settings, not packages that can be installed
+                if main_database is not None and name in main_database:
+                    tag = main
+                else:
+                    continue
+            pinned = pinning.repository_for(name) if pinning is not None else None
+            if tag is None and pinned is not None and pinned in by_tag and name in by_tag[pinned]:
+                tag = pinned
+            if tag is None and main_database is not None and name in main_database:
+                tag = main
+            if tag is None:
+                best_revision = None
+                for candidate, database in repositories:
+                    package = database.get(name)
+                    revision = package.revision if package is not None and package.revision is not None else -1
+                    if package is not None and (best_revision is None or revision > best_revision):
+                        tag = candidate
+                        best_revision = revision
+            packages.append(by_tag[tag][name])
+            provenance[name] = tag
             
-            # if quotes are matched, we've reached the end of a key-value pair
-            if quote_count % 2 == 0:
-                assert key != None, "no key found for %s" % (line)
-                assert key not in attrs, "key already assigned for line %s" % (line)
-                attrs[key] = "".join(chars)
-                
-                # reset parser state
-                chars = []
-                key = None
-                quote_count = 0
+        super(MergedTLDatabase, self).__init__(packages, main_database.mirror if main_database is not None else None)
+        self._repositories = by_tag
+        self._provenance = provenance
+        self.pinning = pinning
+        self.main = main
+        
+    @property
+    def repositories(self):
+        """Read-only mapping of repository tag to its TLDatabase."""
+        return _MappingProxyType(self._repositories)
+        
+    def repository(self, name):
+        """Returns the tag of the repository the package named name was taken from, or None."""
+        return self._provenance.get(name)
+        
+def _parse_tlpdb_file(path, allow_partial, archs, fields):
+    """Parses a whole tlpdb in a worker process; returns the mirror and a marshal string of _packed_package tuples."""
+    import marshal
+    mirror = None
+    values = []
+    with open_tlpdb(path) as flat_tlpdb:
+        for event, value in iter_packages_from_tlpdb(flat_tlpdb, allow_partial, archs=archs, fields=fields):
+            if event == PACKAGE_EVENT:
+                values.append(_packed_package(value))
             else:
-                chars.append(c)
-                
-        else:
-            chars.append(c)
+                mirror = value
+    return mirror, marshal.dumps(values)
     
-    assert key != None, "no key found for %s" % (line)
-    assert len(chars), "no values found for line %s" % (line)
-    attrs[key] = "".join(chars)
-    return attrs
-
-def packages_from_tlpdb(flat_tlpdb, allow_partial=False):
-    """Creates a list of TLPackage objects from the given file-like object.
+def load_repositories(repositories, pinning=None, main="main", allow_partial=False, archs=None, fields=None, use_threads=False):
+    """Parses the tlpdbs of several repositories at the same time and merges them.
     
     Arguments:
-    flat_tlpdb -- A file or file-like object, open for reading
-    allow_partial -- Pass True if you want to return partial data after an error;
-    useful in case of a partial tlpdb download. Default is to raise an exception.
+    repositories -- a list of (tag, path) pairs, e.g., [("main", "texlive.tlpdb.xz"),
+    ("tlcontrib", "tlcontrib.tlpdb.xz")]; paths may be compressed
+    pinning -- PinningRules, or None
+    main -- tag of the main repository
+    allow_partial, archs, fields -- as for iter_packages_from_tlpdb
+    use_threads -- Pass True to parse on threads instead of worker processes,
+    which only helps if reading the files is the slow part
     
     Returns:
-    A list of TLPackage objects
-    
-    """            
+    A MergedTLDatabase.  Each tlpdb is parsed in its own worker, so this takes
+    about as long as the slowest one.  Nothing here uses TLPackage.mirror, so
+    it's safe to load several sets of repositories in one process.
     
-    package = None
-    package_index = 0
-    all_packages = []
-    index_map = {}
-    last_key = None
-    last_arch = None
-
-    for line_idx, line in enumerate(flat_tlpdb):
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
     
-        # seems to be absent in TL 2020 (not in stderr?)
-        if line_idx == 0 and line.startswith("location-url\t"):
-            TLPackage.mirror = line[len("location-url\t"):].strip()
-            continue
-            
-        # comment lines; supported, but not currently used
-        if line.startswith("#"):
-            continue
+    if use_threads or len(repositories) < 2:
+        with ThreadPoolExecutor(max_workers=max(len(repositories), 1)) as executor:
+            futures = [executor.submit(_database_from_path, path, allow_partial, archs, fields) for tag, path in repositories]
+            databases = [future.result() for future in futures]
+    else:
+        import marshal
+        databases = []
+        with ProcessPoolExecutor(max_workers=len(repositories)) as executor:
+            futures = [executor.submit(_parse_tlpdb_file, path, allow_partial, archs, fields) for tag, path in repositories]
+            for future in futures:
+                mirror, payload = future.result()
+                databases.append(TLDatabase([_unpacked_package(values) for values in marshal.loads(payload)], mirror))
                 
-        line = line.strip("\r\n")
+    return MergedTLDatabase([(tag, database) for (tag, path), database in zip(repositories, databases)], pinning, main)
     
-        if len(line) == 0:
-            assert package != None, "Empty line and no package to add. Empty file?"
-            all_packages.append(package)
-            index_map[package.name] = package_index
-            
-            package_index += 1
-            package = None
-            last_key = None
-            last_arch = None
-        else:
-            
-            try:
-                # the first space token is a delimiter
-                key, ignored, value = line.partition(" ")
-                            
-                if package == None:
-                    assert key == "name", "first line must be a name"
-                    package = TLPackage()
+def _database_from_path(path, allow_partial, archs, fields):
+    with open_tlpdb(path) as flat_tlpdb:
+        return TLDatabase.from_tlpdb(flat_tlpdb, allow_partial, archs=archs, fields=fields)
         
-                line_has_key = True
-                if len(key) == 0:
-                    key = last_key
-                    line_has_key = False
-                        
-                if key == "name":
-                    package.name = value
-                elif key == "category":
-                    package.category = value
-                elif key == "revision":
-                    package.revision = int(value)
-                elif key == "relocated":
-                    package.relocated = int(value)
-                elif key == "shortdesc":
-                    if python_major_version < 3:
-                        package.shortdesc = value.decode("utf-8")
-                    else:
-                        package.shortdesc = value
-                elif key == "longdesc":
-                    oldvalue = "" if package.longdesc == None else package.longdesc
-                    if python_major_version < 3:
-                        package.longdesc = oldvalue + " " + value.decode("utf-8")
-                    else:
-                        package.longdesc = oldvalue + " " + value
-                elif key == "depend":
-                    package.depends.append(value)
-                elif key == "catalogue":
-                    package.catalogue = value
-                elif key.startswith("catalogue-"):
-                    catkey = key[len("catalogue-"):]
-                    package.cataloguedata[catkey] = value
-                elif key == "srcfiles":
-                    if line_has_key:
-                        attrs = _attributes_from_line(value)
-                        assert "size" in attrs, "missing size for %s : %s" % (package.name, key)
-                        package.srcsize = int(attrs["size"])
-                    else:
-                        package.srcfiles.append(value)
-                elif key == "binfiles":
-                    if line_has_key:
-                        attrs = _attributes_from_line(value)
-                        assert "arch" in attrs, "missing arch for %s : %s" % (package.name, key)
-                        last_arch = attrs["arch"]
-                        assert "size" in attrs, "missing size for %s : %s" % (package.name, key)
-                        package.binsize[last_arch] = int(attrs["size"])
-                    else:
-                        oldvalue = package.binfiles[last_arch] if last_arch in package.binfiles else []
-                        oldvalue.append(value)
-                        package.binfiles[last_arch] = oldvalue
-                elif key == "docfiles":
-                    # There's an exception handler here because a TL update introduced this abomination:
-                    #   texmf-dist/doc/latex/pythontex/pythontex_quickstart.pdf details=""Quick start" documentation"
-                    # due to a bug in the TeX Catalogue. TLPOBJ.pm uses a gruesome special case to handle this, but
-                    # I'm just going to ignore it unless/until it happens again, since it's supposed to be fixed in
-                    # the tlpdb at some point.
-                    try:
-                        if line_has_key:
-                            attrs = _attributes_from_line(value)
-                            assert "size" in attrs, "missing size for %s : %s" % (package.name, key)
-                            package.docsize = int(attrs["size"])
-                        else:
-                            values = value.split(" ")
-                            if len(values) > 1:
-                                package.docfiledata[values[0]] = _attributes_from_line(" ".join(values[1:]))
-                            package.docfiles.append(values[0])
-                    except Exception as e:
-                        sys.stderr.write("skipping bad docfile line %d in package %s: %s\n" % (line_idx, package.name, line))
-                elif key == "runfiles":
-                    if line_has_key:
-                        attrs = _attributes_from_line(value)
-                        assert "size" in attrs, "missing size for %s : %s" % (package.name, key)
-                        package.runsize = int(attrs["size"])
-                    else:
-                        package.runfiles.append(value)
-                elif key == "postaction":
-                    package.postactions.append(value)
-                elif key == "execute":
-                    package.executes.append(value)
-                else:
-                    package.add_pair(key, value)
-                    #assert False, "unhandled line %s" % (line)
+class ParseCache(object):
+    """Directory of previously written output, keyed by the tlpdb it came from.
+    
+    A tlpdb is identified by its path, size and modification time, plus a
+    hash of its first HEADER_BYTES (which include the repository revision in
+    00texlive.config), and the size and modification time of this script so
+    a changed parser doesn't return stale output.  Entries are evicted least
+    recently used first once the directory grows past max_size bytes.
+    
+    Entries are written to a temporary file and renamed into place, so a
+    reader never sees a partial entry, and eviction is serialized with a lock
+    file.  A reader holding an entry open keeps its data even if another
+    process evicts it, so two reloads racing each other are safe.
+    
+    """
+    
+    HEADER_BYTES = 65536
+    
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        super(ParseCache, self).__init__()
+        import os
+        import errno
+        self.directory = directory
+        self.max_size = max_size
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
                 
-                last_key = key
-            except Exception as e:
-                if allow_partial:
-                    sys.stderr.write("parsed up to junk line \"%s\"\n" % (line))
+    def key(self, tlpdb_path, *extra):
+        """Returns a key for the tlpdb at tlpdb_path and whatever else affects the output, e.g., its format."""
+        import os
+        import hashlib
+        digest = hashlib.sha1()
+        info = os.stat(tlpdb_path)
+        script_info = os.stat(__file__)
+        identity = [os.path.abspath(tlpdb_path), info.st_size, info.st_mtime, script_info.st_size, script_info.st_mtime]
+        digest.update(repr(identity + list(extra)).encode("utf-8"))
+        with open(tlpdb_path, "rb") as tlpdb_file:
+            digest.update(tlpdb_file.read(self.HEADER_BYTES))
+        return digest.hexdigest()
+        
+    def _entry_path(self, key):
+        import os
+        return os.path.join(self.directory, key + ".entry")
+        
+    def open_entry(self, key):
+        """Returns the cached output for key as a binary file open for reading, or None."""
+        import os
+        path = self._entry_path(key)
+        try:
+            entry_file = open(path, "rb")
+        except (IOError, OSError) as e:
+            return None
+        # mark as recently used; a concurrent eviction doesn't matter, since it's open
+        try:
+            os.utime(path, None)
+        except OSError as e:
+            pass
+        return entry_file
+        
+    def store(self, key, source_path, move=False):
+        """Adds the file at source_path as the entry for key, then evicts old entries.
+        
+        With move=True, source_path must be in the cache directory and is renamed
+        instead of copied.
+        
+        """
+        import os
+        import shutil
+        import tempfile
+        if move:
+            temp_path = source_path
+        else:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(fd)
+            shutil.copyfile(source_path, temp_path)
+        os.rename(temp_path, self._entry_path(key))
+        self.evict()
+        
+    def temporary_path(self):
+        """Returns the path of a new, empty file in the cache directory, for use with store(move=True)."""
+        import os
+        import tempfile
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        return temp_path
+        
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_size."""
+        import os
+        import fcntl
+        with open(os.path.join(self.directory, "lock"), "w") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            entries = []
+            total_size = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith(".entry"):
+                    continue
+                try:
+                    info = os.stat(os.path.join(self.directory, name))
+                except OSError as e:
+                    continue
+                entries.append((info.st_mtime, name, info.st_size))
+                total_size += info.st_size
+            entries.sort()
+            for mtime, name, size in entries:
+                if total_size <= self.max_size:
                     break
-                else:
-                    raise e
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    pass
+                total_size -= size
+                
+# Tables are created before loading, and indexes afterwards, which is a lot
+# faster than updating the indexes for every row.  Files of all kinds are in
+# one table; arch is only set for binfiles.
+_SQLITE_SCHEMA = """
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE packages (id INTEGER PRIMARY KEY, name TEXT NOT NULL, category TEXT, revision INTEGER,
+                       shortdesc TEXT, longdesc TEXT, catalogue TEXT, relocated INTEGER,
+                       runsize INTEGER, srcsize INTEGER, docsize INTEGER);
+CREATE TABLE files (package_id INTEGER NOT NULL REFERENCES packages(id), path TEXT NOT NULL, kind TEXT NOT NULL, arch TEXT);
+CREATE TABLE binsizes (package_id INTEGER NOT NULL REFERENCES packages(id), arch TEXT NOT NULL, size INTEGER);
+CREATE TABLE depends (package_id INTEGER NOT NULL REFERENCES packages(id), depend TEXT NOT NULL);
+CREATE TABLE docfiledata (package_id INTEGER NOT NULL REFERENCES packages(id), path TEXT NOT NULL, key TEXT NOT NULL, value TEXT);
+CREATE TABLE catalogue (package_id INTEGER NOT NULL REFERENCES packages(id), key TEXT NOT NULL, value TEXT);
+CREATE TABLE actions (package_id INTEGER NOT NULL REFERENCES packages(id), kind TEXT NOT NULL, value TEXT);
+CREATE TABLE extradata (package_id INTEGER NOT NULL REFERENCES packages(id), key TEXT NOT NULL, value TEXT);
+"""
 
-    return all_packages, index_map
-    
-def _save_as_sqlite(packages, absolute_path):
-    """Save a list of packages as an SQLite3 binary file.
+# not unique, since a tlpdb can have two records with the same name
+_SQLITE_INDEXES = """
+CREATE INDEX packages_name ON packages (name);
+CREATE INDEX packages_category ON packages (category);
+CREATE INDEX files_package ON files (package_id);
+CREATE INDEX files_path ON files (path);
+CREATE INDEX binsizes_package ON binsizes (package_id);
+CREATE INDEX depends_package ON depends (package_id);
+CREATE INDEX depends_depend ON depends (depend);
+CREATE INDEX docfiledata_package ON docfiledata (package_id);
+CREATE INDEX catalogue_package ON catalogue (package_id);
+CREATE INDEX actions_package ON actions (package_id);
+CREATE INDEX extradata_package ON extradata (package_id);
+"""
+
+# table name and number of columns, in insertion order
+_SQLITE_TABLES = (("packages", 11), ("files", 4), ("binsizes", 3), ("depends", 2), ("docfiledata", 4),
+                  ("catalogue", 3), ("actions", 3), ("extradata", 3))
+
+# packages per executemany batch; bounds memory use when packages is a generator
+_SQLITE_BATCH_SIZE = 500
+
+def _save_as_sqlite(packages, absolute_path, mirror=None):
+    """Save packages as an SQLite3 binary file.
     
     Arguments:
-    packages -- a list of TLPackage objects
+    packages -- an iterable of TLPackage objects; this can be a generator
     absolute_path -- output path for the database
+    mirror -- the location-url of the tlpdb; default is TLPackage.mirror
+    
+    Returns:
+    The number of packages written.
     
     An existing file at this path will be removed before writing, to ensure that
     you end up with a consistent database.  This is mainly for symmetry with the
     plist writing method.
     
-    Not all values are saved to sqlite.  Notably runfiles and other dictionary
-    types are not written at present, since they should probably be in a separate
-    table.
+    Everything in a TLPackage is saved, in the normalized tables of _SQLITE_SCHEMA.
+    The mirror (if any) is the "mirror" key in the metadata table.  Rows are loaded
+    with executemany in a single transaction, with journaling relaxed for the
+    build, and indexes are created once everything is loaded.  Packages with
+    the same name each get a row, as each gets an entry in the plist.
     
     """
     import sqlite3
     import os
     import errno
     
-    def _adapt_list(lst):
-        if lst is None or len(lst) == 0:
-            return None
-        return buffer("\0".join(lst).encode("utf-8"))
-
-    sqlite3.register_adapter(list, _adapt_list)
-    sqlite3.register_adapter(tuple, _adapt_list)
+    if mirror is None:
+        mirror = TLPackage.mirror
     
     # plistlib will overwrite the previous file, so do the same with sqlite
     # instead of adding rows
-    try:
-        os.remove(absolute_path)
-    except OSError as e:
-        if e.errno != errno.ENOENT:
-            raise e
+    for path in (absolute_path, absolute_path + "-wal", absolute_path + "-shm", absolute_path + "-journal"):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise e
             
     assert os.path.exists(absolute_path) == False, "File exists: %s" % (absolute_path)
-    conn = sqlite3.connect(absolute_path, detect_types=sqlite3.PARSE_DECLTYPES)
-    c = conn.cursor()
-    c.execute("""CREATE table packages (name text, category text, revision real, shortdesc text, longdesc text, runfiles blob, srcfiles blob, docfiles blob)""")
-    for pkg in all_packages:
-        pkg.insert_in_packages(conn)
+    conn = sqlite3.connect(absolute_path, isolation_level=None)
+    package_count = 0
+    try:
+        # it's a new file, so if we crash it gets thrown away anyway
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executescript(_SQLITE_SCHEMA)
+        
+        inserts = [(table, "INSERT INTO %s VALUES (%s)" % (table, ",".join("?" * column_count))) for table, column_count in _SQLITE_TABLES]
+        
+        def _flush(batch):
+            for table, statement in inserts:
+                if batch[table]:
+                    conn.executemany(statement, batch[table])
+        
+        conn.execute("BEGIN")
+        if mirror:
+            conn.execute("INSERT INTO metadata VALUES (?,?)", ("mirror", mirror))
+        batch = dict((table, []) for table, column_count in _SQLITE_TABLES)
+        for pkg in packages:
+            package_count += 1
+            rows = pkg.sqlite_rows(package_count)
+            for table in rows:
+                batch[table] += rows[table]
+            if package_count % _SQLITE_BATCH_SIZE == 0:
+                _flush(batch)
+                batch = dict((table, []) for table, column_count in _SQLITE_TABLES)
+        _flush(batch)
+        conn.execute("COMMIT")
+        
+        conn.executescript(_SQLITE_INDEXES)
+        conn.execute("ANALYZE")
+        # back to a single self-contained file
+        conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        conn.close()
+        
+    return package_count
     
-    conn.close()
+_PLIST_HEADER = b"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+"""
+
+# anything _plist_escape has to deal with; the rest can be written as-is
+_PLIST_SPECIAL_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\r&<>]")
+_PLIST_CONTROL_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _plist_escape(text):
+    """Escapes a string for XML, the same way plistlib does."""
+    if _PLIST_SPECIAL_CHARS_RE.search(text) is None:
+        return text
+    if _PLIST_CONTROL_CHARS_RE.search(text) is not None:
+        raise ValueError("strings can't contain control characters")
+    text = text.replace("\r\n", "\n")
+    text = text.replace("\r", "\n")
+    text = text.replace("&", "&amp;")
+    text = text.replace("<", "&lt;")
+    text = text.replace(">", "&gt;")
+    return text
     
-def _save_as_plist(packages, path_or_file):
-    """Save a list of packages as a Mac OS X property list.
+def _plist_fragments(value, indent, out):
+    """Appends the XML for value to the list out, formatted as plistlib would at this indent."""
+    if isinstance(value, _string_types):
+        out.append("%s<string>%s</string>\n" % (indent, _plist_escape(value)))
+    elif value is True or value is False:
+        out.append("%s<%s/>\n" % (indent, "true" if value else "false"))
+    elif isinstance(value, int):
+        out.append("%s<integer>%d</integer>\n" % (indent, value))
+    elif isinstance(value, dict):
+        if not value:
+            out.append(indent + "<dict/>\n")
+            return
+        out.append(indent + "<dict>\n")
+        inner = indent + "\t"
+        for key in sorted(value):
+            out.append("%s<key>%s</key>\n" % (inner, _plist_escape(key)))
+            _plist_fragments(value[key], inner, out)
+        out.append(indent + "</dict>\n")
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            out.append(indent + "<array/>\n")
+            return
+        inner = indent + "\t"
+        # File lists are the bulk of the output, so check them with a single
+        # search, and only escape individual strings if that finds something.
+        try:
+            joined = "\n".join(value)
+        except TypeError as e:
+            joined = None
+        if joined is not None and _PLIST_SPECIAL_CHARS_RE.search(joined) is None:
+            separator = "</string>\n%s<string>" % (inner)
+            out.append("%s<array>\n%s<string>%s</string>\n%s</array>\n" % (indent, inner, separator.join(value), indent))
+            return
+        out.append(indent + "<array>\n")
+        for item in value:
+            _plist_fragments(item, inner, out)
+        out.append(indent + "</array>\n")
+    else:
+        raise TypeError("unsupported type: %s" % type(value))
+        
+def _save_as_plist(packages, path_or_file, mirror=None, fields=None):
+    """Save packages as a Mac OS X property list.
     
     Arguments:
-    packages -- a list of TLPackage objects
-    path_or_file -- output file (path or a file-like object) for the database
+    packages -- an iterable of TLPackage objects; each one is serialized and
+    written as it's produced, so this can be a generator
+    path_or_file -- output file (path or a file-like object open for writing bytes)
+    for the database, or sys.stdout
+    mirror -- the location-url of the tlpdb; default is TLPackage.mirror
+    fields -- package dictionary keys to write, or None for all of them
+    
+    Returns:
+    The number of packages written.
     
     The root object of the output property list is a dictionary.  Keys at
     present are "mirror" (may not exist) and "packages", which is a list
-    of TLPackage dictionary values.
+    of TLPackage dictionary values.  The output is an XML property list,
+    byte-for-byte the same as plistlib would write for the whole document,
+    but without ever holding more than one package in memory.
     
     """
-    import plistlib
-    plist = {}
-    # only for remote tlpdb
-    if TLPackage.mirror:
-        plist["mirror"] = TLPackage.mirror
-    plist["packages"] = []
-    for pkg in all_packages:
-        plist["packages"].append(pkg.dictionary_value())
     
-    if python_major_version < 3:
-        plistlib.writePlist(plist, path_or_file)
+    if mirror is None:
+        mirror = TLPackage.mirror
+        
+    if path_or_file == sys.stdout:
+        output_file = getattr(sys.stdout, "buffer", sys.stdout)
+        should_close = False
+    elif hasattr(path_or_file, "write"):
+        output_file = path_or_file
+        should_close = False
     else:
-        # Apparently writePlistToBytes() was removed in Python 3.9, but its
-        # replacement of dumps() is only available in 3.4 and later. This is
-        # some silly bullshit. Try the new method first, and fall back to the
-        # old one, I guess.
-        try:
-            bytes_output = plistlib.dumps(plist)
-        except Exception as exc:
-            bytes_output = plistlib.writePlistToBytes(plist)
+        output_file = open(path_or_file, "wb")
+        should_close = True
+        
+    package_count = 0
+    try:
+        output_file.write(_PLIST_HEADER)
+        output_file.write(b"<dict>\n")
+        # only for remote tlpdb
+        if mirror:
+            output_file.write(("\t<key>mirror</key>\n\t<string>%s</string>\n" % (_plist_escape(mirror))).encode("utf-8"))
+        output_file.write(b"\t<key>packages</key>\n")
+        
+        for pkg in packages:
+            # the array is opened here, since it's written as <array/> if empty
+            out = ["\t<array>\n"] if package_count == 0 else []
+            _plist_fragments(pkg.dictionary_value(fields), "\t\t", out)
+            output_file.write("".join(out).encode("utf-8"))
+            package_count += 1
+            
+        output_file.write(b"\t</array>\n" if package_count else b"\t<array/>\n")
+        output_file.write(b"</dict>\n</plist>\n")
+        output_file.flush()
+    finally:
+        if should_close:
+            output_file.close()
+            
+    return package_count
+    
+def _save_as_jsonl(packages, path_or_file, mirror=None, fields=None):
+    """Save packages as JSON Lines, for consumers that want packages as they're parsed.
+    
+    Arguments:
+    packages -- an iterable of TLPackage objects; each one is written and
+    flushed as it's produced, so this can be a generator
+    path_or_file -- output file (path or a file-like object open for writing bytes),
+    or sys.stdout
+    mirror -- the location-url of the tlpdb; default is TLPackage.mirror
+    fields -- package dictionary keys to write, or None for all of them
+    
+    Returns:
+    The number of packages written.
+    
+    The first line is an object with a "mirror" key, which is null for a
+    local tlpdb.  Every following line is one package's dictionary value,
+    with the same keys as in the property list.
+    
+    """
+    import json
+    
+    if mirror is None:
+        mirror = TLPackage.mirror
+        
+    if path_or_file == sys.stdout:
+        output_file = getattr(sys.stdout, "buffer", sys.stdout)
+        should_close = False
+    elif hasattr(path_or_file, "write"):
+        output_file = path_or_file
+        should_close = False
+    else:
+        output_file = open(path_or_file, "wb")
+        should_close = True
+        
+    package_count = 0
+    try:
+        # the header is written like the package lines, so a mirror URL with
+        # non-ASCII characters comes out the same way theirs do
+        dumps_options = { "sort_keys" : True, "ensure_ascii" : False, "separators" : (",", ":") }
+        output_file.write((json.dumps({"mirror" : mirror}, **dumps_options) + "\n").encode("utf-8"))
+        output_file.flush()
+        for pkg in packages:
+            line = json.dumps(pkg.dictionary_value(fields), **dumps_options)
+            output_file.write((line + "\n").encode("utf-8"))
+            # so a reader at the other end of a pipe gets each package right away
+            output_file.flush()
+            package_count += 1
+    finally:
+        if should_close:
+            output_file.close()
+            
+    return package_count
+    
+def _mirror_and_packages(events):
+    """Splits the events from iter_packages_from_tlpdb.
+    
+    Returns:
+    The mirror URL (or None) and an iterator of TLPackage objects.  Only the
+    first event is consumed here, so the packages are still parsed lazily.
+    
+    """
+    mirror = None
+    first_event = next(events, None)
+    if first_event is not None and first_event[0] == MIRROR_EVENT:
+        mirror = first_event[1]
+        first_event = None
+        
+    def _packages():
+        if first_event is not None:
+            yield first_event[1]
+        for event, value in events:
+            if event == PACKAGE_EVENT:
+                yield value
+                
+    return mirror, _packages()
+    
+class _TimedWriter(object):
+    """File-like wrapper that adds the time spent writing and the bytes written to a _RunStats."""
+    
+    def __init__(self, output_file, stats):
+        super(_TimedWriter, self).__init__()
+        self._file = output_file
+        self._stats = stats
+        
+    def write(self, data):
+        start = self._stats.clock()
+        self._file.write(data)
+        self._stats.write_time += self._stats.clock() - start
+        self._stats.bytes_out += len(data)
+        
+    def flush(self):
+        start = self._stats.clock()
+        self._file.flush()
+        self._stats.write_time += self._stats.clock() - start
+        
+class _RunStats(object):
+    """Phase timings and counts for --stats.
+    
+    Input is read and packages are written as they're parsed, so the phases
+    are interleaved.  The input lines, the packages and the output file are
+    wrapped to time each of them, and the parse and serialize times are what's
+    left over.  Lines are read in batches, so timing them costs next to nothing.
+    
+    """
+    
+    def __init__(self):
+        super(_RunStats, self).__init__()
+        import time
+        self.clock = getattr(time, "perf_counter", time.time)
+        self._cpu_clock = getattr(time, "process_time", time.clock if hasattr(time, "clock") else time.time)
+        self._started = self.clock()
+        self._cpu_started = self._cpu_clock()
+        self.read_time = 0.0
+        # time spent producing packages, including reading their lines
+        self.package_time = 0.0
+        self.serialize_time = 0.0
+        self.write_time = 0.0
+        self.lines = 0
+        self.packages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cache = None
+        
+    def timed_lines(self, lines):
+        """Yields the lines of an iterable, timing how long they take to read."""
+        import itertools
+        clock = self.clock
+        iterator = iter(lines)
+        while True:
+            start = clock()
+            batch = list(itertools.islice(iterator, 1024))
+            self.read_time += clock() - start
+            if not batch:
+                return
+            self.lines += len(batch)
+            text = "".join(batch)
+            self.bytes_in += len(text if isinstance(text, bytes) else text.encode("utf-8"))
+            for line in batch:
+                yield line
+                
+    def timed_packages(self, packages):
+        """Yields the packages of an iterable, timing how long each one takes to produce."""
+        clock = self.clock
+        iterator = iter(packages)
+        while True:
+            start = clock()
+            try:
+                package = next(iterator)
+            except StopIteration:
+                self.package_time += clock() - start
+                return
+            self.package_time += clock() - start
+            self.packages += 1
+            yield package
             
-        str_output = bytes_output.decode("UTF-8")
-        if path_or_file == sys.stdout:
-            sys.stdout.write(str_output)
+    def timed_output(self, output_file):
+        return _TimedWriter(output_file, self)
+        
+    def report(self, output_file):
+        """Writes the counts and timings to output_file as one line of JSON."""
+        import json
+        stats = {}
+        stats["total_seconds"] = self.clock() - self._started
+        stats["cpu_seconds"] = self._cpu_clock() - self._cpu_started
+        stats["phases"] = {
+            "read" : self.read_time,
+            "parse" : max(0.0, self.package_time - self.read_time),
+            "serialize" : self.serialize_time,
+            "write" : self.write_time,
+        }
+        stats["lines"] = self.lines
+        stats["packages"] = self.packages
+        stats["bytes_in"] = self.bytes_in
+        stats["bytes_out"] = self.bytes_out
+        if self.cache is not None:
+            stats["cache"] = self.cache
+        try:
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # bytes on Mac OS X, kilobytes everywhere else
+            stats["max_rss_bytes"] = max_rss if sys.platform == "darwin" else max_rss * 1024
+        except ImportError:
+            pass
+        # only if Python was started with -X tracemalloc, since tracing every
+        # allocation would make the timings meaningless
+        tracemalloc = sys.modules.get("tracemalloc")
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            stats["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        output_file.write(json.dumps(stats, sort_keys=True) + "\n")
+        output_file.flush()
+    
+def _plist_fast_path(argv):
+    """Runs the common [-p] -o PATH -f plist [tlpdb_path] invocation without optparse.
+    
+    Returns:
+    The exit status, or None if argv has anything else in it, in which case
+    nothing was done.
+    
+    TLMDatabase runs that command line on every reload.  It goes straight to
+    the streaming parser and plist writer, so nothing is imported that
+    wouldn't be used; optparse alone pulls in gettext, locale and textwrap for
+    help output that's never printed.  Output is the same as the full command
+    line handling would write.
+    
+    """
+    # the query server has its own options
+    if argv[:1] == ["serve"]:
+        return None
+    allow_partial = False
+    output_path = None
+    output_format = None
+    tlpdb_path = None
+    idx = 0
+    while idx < len(argv):
+        arg = argv[idx]
+        if arg in ("-p", "--partial"):
+            allow_partial = True
+        elif arg in ("-o", "--output", "-f", "--format") and idx + 1 < len(argv):
+            idx += 1
+            if arg in ("-o", "--output"):
+                output_path = argv[idx]
+            else:
+                output_format = argv[idx]
+        elif arg.startswith("-") or tlpdb_path is not None:
+            return None
         else:
-            output_file = open(path_or_file, 'w')
-            output_file.write(str_output)
+            tlpdb_path = arg
+        idx += 1
+    # without -f, the format would be guessed from the output path
+    if output_format != "plist" and (output_format is not None or output_path is not None):
+        return None
+        
+    flat_tlpdb = open_tlpdb(tlpdb_path if tlpdb_path is not None else sys.stdin)
+    mirror, packages = _mirror_and_packages(iter_packages_from_tlpdb(flat_tlpdb, allow_partial))
+    package_count = _save_as_plist(packages, output_path if output_path else sys.stdout, mirror)
+    if package_count == 0:
+        import os
+        sys.stderr.write("Did not find any packages in TeX Live Database\n")
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+        return 1
+    return 0
     
 if __name__ == '__main__':
     
+    status = _plist_fast_path(sys.argv[1:])
+    if status is not None:
+        exit(status)
+        
     from optparse import OptionParser
     import sys
+    import os
+    
+    # parse_tlpdb.py serve [options] tlpdb_path
+    if sys.argv[1:2] == ["serve"]:
+        # tlpdb_server imports parse_tlpdb, which would otherwise load this
+        # file a second time, with TLPackage and the rest as different classes
+        sys.modules.setdefault("parse_tlpdb", sys.modules[__name__])
+        from tlpdb_server import main as serve_main
+        exit(serve_main(sys.argv[2:]))
         
     usage = "usage: %prog [options] [tlpdb_path or stdin]"
     parser = OptionParser()
     parser.set_usage(usage)
     parser.add_option("-o", "--output", dest="output_path", help="write tlpdb to FILE", metavar="FILE", action="store", type="string")
-    parser.add_option("-f", "--format", dest="output_format", help="[sqlite3 | plist] (default is to guess from output file extension)", metavar="FORMAT", action="store", type="string")
+    parser.add_option("-f", "--format", dest="output_format", help="[sqlite3 | plist | jsonl] (default is to guess from output file extension)", metavar="FORMAT", action="store", type="string")
     parser.add_option("-p", "--partial", dest="allow_partial", help="read file contents until an error occurs and return partial data", action="store_true", default=False)
+    parser.add_option("--header-only", dest="header_only", help="only write the repository settings from the 00texlive records, as a plist", action="store_true", default=False)
+    parser.add_option("--cache-dir", dest="cache_dir", help="reuse output from a previous run on the same tlpdb, cached in DIR", metavar="DIR", action="store", type="string")
+    parser.add_option("--cache-size", dest="cache_size", help="maximum size of the cache directory in MB (default 256)", metavar="MB", action="store", type="int", default=256)
+    parser.add_option("--snapshot", dest="snapshot_path", help="only parse packages that changed since the snapshot in FILE, then update it", metavar="FILE", action="store", type="string")
+    parser.add_option("--delta", dest="delta_path", help="with --snapshot, write added, removed and changed package names to FILE as a plist", metavar="FILE", action="store", type="string")
+    parser.add_option("-j", "--jobs", dest="jobs", help="parse with N processes; needs an uncompressed tlpdb path", metavar="N", action="store", type="int", default=1)
+    parser.add_option("--file-index", dest="file_index_path", help="also write an index of file paths to owning packages to FILE", metavar="FILE", action="store", type="string")
+    parser.add_option("--fields", dest="fields", help="only parse and write these comma-separated package keys, e.g. name,revision,runFiles", metavar="KEYS", action="store", type="string")
+    parser.add_option("--stats", dest="stats", help="print timings for each phase, counts and peak memory to stderr as JSON", action="store_true", default=False)
+    parser.add_option("--profile", dest="profile_path", help="write cProfile data for the run to FILE", metavar="FILE", action="store", type="string")
+    parser.add_option("--arch", dest="archs", help="only keep binaries for ARCH; may be repeated, and \"host\" is this machine's platform", metavar="ARCH", action="append", type="string")
     
     (options, args) = parser.parse_args(sys.argv[1:])    
     
+    # both are written at exit, so they also cover the early exits below
+    if options.profile_path:
+        import atexit
+        import cProfile
+        profiler = cProfile.Profile()
+        def _write_profile():
+            profiler.disable()
+            profiler.dump_stats(options.profile_path)
+        atexit.register(_write_profile)
+        profiler.enable()
+        
+    stats = None
+    if options.stats:
+        import atexit
+        stats = _RunStats()
+        atexit.register(stats.report, sys.stderr)
+    
+    archs = None
+    if options.archs:
+        archs = []
+        for arch in options.archs:
+            arch = host_platform() if arch == "host" else arch
+            if arch not in archs:
+                archs.append(arch)
+        # a snapshot has to hold every package, or the next delta would be wrong
+        if options.snapshot_path:
+            sys.stderr.write("--arch can't be used with --snapshot\n")
+            exit(1)
+            
+    fields = None
+    parse_fields = None
+    if options.fields:
+        fields = [field.strip() for field in options.fields.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in PACKAGE_FIELDS]
+        if unknown:
+            sys.stderr.write("Unknown fields %s; valid fields are %s\n" % (", ".join(unknown), ", ".join(PACKAGE_FIELDS)))
+            exit(1)
+        if options.snapshot_path:
+            sys.stderr.write("--fields can't be used with --snapshot\n")
+            exit(1)
+        # the file index needs every file list, even if they aren't written
+        parse_fields = fields
+        if options.file_index_path:
+            parse_fields = fields + ["runFiles", "sourceFiles", "docFiles", "binFiles"]
+    
     # can't write sqlite3 to stdout (at least, not easily)
     if not options.output_path:
         if options.output_format == "sqlite3":
@@ -454,15 +3164,16 @@ if __name__ == '__main__':
             parser.print_help(file=sys.stderr)
             exit(1) 
         else:
-            # either no format given or no output path given; in either case, this requires a plist format
-            options.output_format = "plist"
+            # no output path given, so there's no extension to guess from; plist unless asked for JSON Lines
+            if options.output_format != "jsonl":
+                options.output_format = "plist"
             options.output_path = sys.stdout
 
     if not options.output_format:
         dot_idx = options.output_path.rfind(".") + 1
         if dot_idx != -1:
             options.output_format = options.output_path[dot_idx:]
-            if options.output_format not in ("sqlite3", "plist"):
+            if options.output_format not in ("sqlite3", "plist", "jsonl"):
                 sys.stderr.write("Unable to guess output format from extension .%s\n" % (options.output_format))
                 parser.print_help(file=sys.stderr)
                 exit(1)
@@ -470,19 +3181,169 @@ if __name__ == '__main__':
             sys.stderr.write("Must supply an output format or known output path extension\n")
             parser.print_help(file=sys.stderr)
             exit(1)
+    elif options.output_format not in ("sqlite3", "plist", "jsonl"):
+        sys.stderr.write("Unknown output format %s\n" % (options.output_format))
+        parser.print_help(file=sys.stderr)
+        exit(1)
+
+    # Only output that depends on nothing but the tlpdb file is cached; stdin
+    # from tlmgr dump-tlpdb has no identity to check against.
+    # JSON Lines on stdout is for pipelines that want packages as they're parsed,
+    # which writing to the cache first would defeat.  A snapshot and delta have
+    # to be written on every run, so a cache hit can't stand in for those.
+    streaming = options.output_format == "jsonl" and options.output_path == sys.stdout
+    cache = None
+    if options.cache_dir and len(args) and not options.header_only and not options.file_index_path and not options.snapshot_path and not streaming:
+        import shutil
+        cache = ParseCache(options.cache_dir, options.cache_size * 1024 * 1024)
+        cache_key = cache.key(args[0], options.output_format, options.allow_partial, archs, fields)
+        cached_file = cache.open_entry(cache_key)
+        if stats is not None:
+            stats.cache = "miss" if cached_file is None else "hit"
+        if cached_file is not None:
+            if stats is not None:
+                stats.bytes_out = os.fstat(cached_file.fileno()).st_size
+            with cached_file:
+                if options.output_path == sys.stdout:
+                    shutil.copyfileobj(cached_file, getattr(sys.stdout, "buffer", sys.stdout))
+                else:
+                    with open(options.output_path, "wb") as output_file:
+                        shutil.copyfileobj(cached_file, output_file)
+            exit(0)
+        # written to the cache first, then copied to stdout
+        if options.output_path == sys.stdout:
+            cache_output_path = cache.temporary_path()
+        else:
+            cache_output_path = options.output_path
 
+    # the workers read the file themselves
+    parallel = len(args) and not options.header_only and not options.snapshot_path and _can_parse_in_parallel(args[0], options.jobs)
+    
     # "/usr/local/texlive/2011/tlpkg/texlive.tlpdb"
-    flat_tlpdb = open(args[0], "r") if len(args) else sys.stdin
-    all_packages, index_map = packages_from_tlpdb(flat_tlpdb, options.allow_partial)
+    # decompressed as it's read if this is texlive.tlpdb.xz from a mirror
+    flat_tlpdb = None
+    if not parallel:
+        flat_tlpdb = open_tlpdb(args[0] if len(args) else sys.stdin)
+        if stats is not None:
+            flat_tlpdb = stats.timed_lines(flat_tlpdb)
+    
+    if options.header_only:
+        if options.output_format != "plist":
+            sys.stderr.write("Header output must be a plist\n")
+            exit(1)
+        import plistlib
+        header = header_from_tlpdb(flat_tlpdb, options.allow_partial)
+        if "release" not in header:
+            sys.stderr.write("Did not find 00texlive.config in TeX Live Database\n")
+            exit(1)
+        if python_major_version < 3:
+            header_data = plistlib.writePlistToString(header)
+        else:
+            header_data = plistlib.dumps(header)
+        if options.output_path == sys.stdout:
+            getattr(sys.stdout, "buffer", sys.stdout).write(header_data)
+        else:
+            with open(options.output_path, "wb") as output_file:
+                output_file.write(header_data)
+        exit(0)
+        
+    if stats is not None:
+        parse_started = stats.clock()
+        
+    if options.snapshot_path:
+        # needs every package in memory, for the next snapshot
+        previous_packages = []
+        previous_mirror = None
+        if os.path.exists(options.snapshot_path):
+            try:
+                previous_packages, previous_mirror = load_snapshot(options.snapshot_path)
+            except AssertionError as e:
+                # e.g., written by an older parse_tlpdb; parse everything and replace it
+                sys.stderr.write("ignoring snapshot %s: %s\n" % (options.snapshot_path, e))
+        packages, index_map, delta, mirror = update_packages_from_tlpdb(flat_tlpdb, previous_packages, options.allow_partial)
+        # an unchanged tlpdb is the common case, and the snapshot is as big as the tlpdb
+        unchanged = previous_packages and mirror == previous_mirror and not (delta["added"] or delta["removed"] or delta["changed"])
+        if packages and not unchanged:
+            save_snapshot(packages, options.snapshot_path, mirror)
+        if options.delta_path:
+            import plistlib
+            with open(options.delta_path, "wb") as delta_file:
+                if python_major_version < 3:
+                    plistlib.writePlist(delta, delta_file)
+                else:
+                    plistlib.dump(delta, delta_file)
+    elif parallel:
+        packages, index_map, mirror, line_count = _parallel_parse(args[0], options.jobs, options.allow_partial, archs, parse_fields)
+        if stats is not None:
+            # read by the workers, which count the lines of their pieces
+            stats.lines = line_count
+            stats.bytes_in = os.path.getsize(args[0])
+    else:
+        # packages are written as they're parsed, so memory use doesn't depend on the tlpdb size
+        mirror, packages = _mirror_and_packages(iter_packages_from_tlpdb(flat_tlpdb, options.allow_partial, archs=archs, fields=parse_fields))
+    
+    file_index = None
+    if options.file_index_path:
+        file_index = FileOwnerIndex()
+        packages = file_index.add_packages(packages)
+        
+    output_path = cache_output_path if cache is not None else options.output_path
+    output_target = output_path
+    if stats is not None:
+        # everything parsed up front, for a snapshot or in worker processes
+        stats.package_time += stats.clock() - parse_started
+        packages = stats.timed_packages(packages)
+        package_time_before_output = stats.package_time
+        output_started = stats.clock()
+        if options.output_format != "sqlite3":
+            if output_path == sys.stdout:
+                output_target = stats.timed_output(getattr(sys.stdout, "buffer", sys.stdout))
+            else:
+                output_target = stats.timed_output(open(output_path, "wb"))
+                
+    if options.output_format == "sqlite3":
+        package_count = _save_as_sqlite(packages, output_path, mirror)
+    elif options.output_format == "plist":
+        package_count = _save_as_plist(packages, output_target, mirror, fields)
+    elif options.output_format == "jsonl":
+        try:
+            package_count = _save_as_jsonl(packages, output_target, mirror, fields)
+        except IOError as e:
+            import errno
+            if not streaming or e.errno != errno.EPIPE:
+                raise
+            # the reader is done with the pipe (e.g., head), which is fine for a
+            # pipeline; point stdout at /dev/null so the exit flush doesn't complain
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            exit(0)
+            
+    if stats is not None:
+        output_time = stats.clock() - output_started - (stats.package_time - package_time_before_output)
+        if options.output_format == "sqlite3":
+            # sqlite3 serializes and writes in one step, so it's all counted as writing
+            stats.write_time = output_time
+            stats.bytes_out = os.path.getsize(output_path)
+        else:
+            stats.serialize_time = output_time - stats.write_time
+            if output_target._file is not getattr(sys.stdout, "buffer", sys.stdout):
+                output_target._file.close()
 
-    if len(all_packages) == 0:
+    if package_count == 0:
         sys.stderr.write("Did not find any packages in TeX Live Database\n")
+        if output_path != sys.stdout and os.path.exists(output_path):
+            os.remove(output_path)
         exit(1)
-
-    if options.output_format == "sqlite3":
-        _save_as_sqlite(all_packages, options.output_path)
-    elif options.output_format == "plist":
-        _save_as_plist(all_packages, options.output_path)
+        
+    if cache is not None:
+        if output_path != options.output_path:
+            with open(output_path, "rb") as cached_file:
+                shutil.copyfileobj(cached_file, getattr(sys.stdout, "buffer", sys.stdout))
+            cache.store(cache_key, output_path, move=True)
+        else:
+            cache.store(cache_key, output_path)
+        
+    if file_index is not None:
+        file_index.save(options.file_index_path)
         
     # pkg = all_packages[index_map["00texlive.installation"]]
     # for dep in pkg.depends:
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+
+#
+# This software is Copyright (c) 2026
+# Adam Maxwell. All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 
+# - Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in
+# the documentation and/or other materials provided with the
+# distribution.
+# 
+# - Neither the name of Adam Maxwell nor the names of any
+# contributors may be used to endorse or promote products derived
+# from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# Dependency graph over the packages parsed by parse_tlpdb.py.  Resolves the
+# flat TLPackage.depends lists, including .ARCH platform dependencies, and
+# answers transitive closure queries like "what does scheme-full pull in if
+# I leave out collection-latexextra and collection-games":
+#
+#   $ ./tlpdb_depgraph.py -t texlive.tlpdb -a x86_64-linux -x collection-games scheme-full
+#
+# Packages are numbered in tlpdb order and sets of packages are stored as
+# Python ints used as bitsets.  Cycles (collections do depend on each other)
+# are condensed into strongly connected components, and the closure of every
+# component is computed once, when the graph is built, so a query only has to
+# OR together the closures of the packages it reaches.
+
+import sys
+
+def _bit_indexes(mask):
+    """Returns a list of the indexes of the bits set in mask, lowest first."""
+    # bin() is much faster than shifting a 6000 bit int one bit at a time
+    bits = bin(mask)[:1:-1]
+    indexes = []
+    idx = bits.find("1")
+    while idx != -1:
+        indexes.append(idx)
+        idx = bits.find("1", idx + 1)
+    return indexes
+
+def _bit_count(mask):
+    # int.bit_count is new in Python 3.10
+    return bin(mask).count("1")
+
+class DependencyGraph(object):
+    """Resolved package dependencies.
+    
+    Arguments:
+    packages -- a list of TLPackage instances, as returned by packages_from_tlpdb
+    archs -- architectures to expand name.ARCH dependencies for; None expands
+    them for every architecture in the database
+    
+    Dependencies on packages that aren't in the database, as well as the
+    release/ and opt_ settings of the 00texlive.* records, are kept in the
+    unresolved dictionary instead of the graph.
+    
+    """
+    
+    def __init__(self, packages, archs=None):
+        super(DependencyGraph, self).__init__()
+        self.names = [pkg.name for pkg in packages]
+        self._index = dict((name, idx) for idx, name in enumerate(self.names))
+        self.archs = None if archs is None else list(archs)
+        self.unresolved = {}
+        
+        # name.ARCH expands to every name.something in the database
+        arch_variants = {}
+        for idx, name in enumerate(self.names):
+            base, dot, arch = name.rpartition(".")
+            if dot and (archs is None or arch in archs):
+                arch_variants.setdefault(base, []).append(idx)
+        
+        index = self._index
+        successors = []
+        for pkg in packages:
+            targets = []
+            for dep in pkg.depends:
+                if dep.endswith(".ARCH"):
+                    # no architectures selected is not an error
+                    targets.extend(arch_variants.get(dep[:-5], ()))
+                    continue
+                idx = index.get(dep)
+                if idx is None:
+                    self.unresolved.setdefault(pkg.name, []).append(dep)
+                else:
+                    targets.append(idx)
+            successors.append(targets)
+        self._successors = successors
+        self._predecessors = None
+        
+        # Most dependencies of a collection are packages that don't depend on
+        # anything, so closure() with exclusions handles those as one bitset
+        # per package instead of following each edge.
+        leaf_masks = []
+        inner_successors = []
+        for targets in successors:
+            leaf_mask = 0
+            inner = []
+            for succ in targets:
+                if successors[succ]:
+                    inner.append(succ)
+                else:
+                    leaf_mask |= 1 << succ
+            leaf_masks.append(leaf_mask)
+            inner_successors.append(inner)
+        self._leaf_masks = leaf_masks
+        self._inner_successors = inner_successors
+        self._condense()
+        
+    def _condense(self):
+        """Finds strongly connected components and the closure bitset of each one."""
+        
+        # iterative Tarjan, since scheme-full -> collection -> package chains
+        # are deep enough to worry about the recursion limit on big databases
+        successors = self._successors
+        count = len(successors)
+        order = [-1] * count
+        lowlink = [0] * count
+        on_stack = [False] * count
+        stack = []
+        component_of = [-1] * count
+        components = []
+        closures = []
+        counter = 0
+        
+        for root in range(count):
+            if order[root] != -1:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, edge_idx = work.pop()
+                if edge_idx == 0:
+                    order[node] = lowlink[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+                edges = successors[node]
+                recurse = False
+                while edge_idx < len(edges):
+                    succ = edges[edge_idx]
+                    edge_idx += 1
+                    if order[succ] == -1:
+                        work.append((node, edge_idx))
+                        work.append((succ, 0))
+                        recurse = True
+                        break
+                    elif on_stack[succ] and order[succ] < lowlink[node]:
+                        lowlink[node] = order[succ]
+                if recurse:
+                    continue
+                
+                if lowlink[node] == order[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component_of[member] = len(components)
+                        members.append(member)
+                        if member == node:
+                            break
+                    # Tarjan emits components after everything they reach, so
+                    # the successors' closures are already known
+                    mask = 0
+                    for member in members:
+                        mask |= 1 << member
+                    for member in members:
+                        for succ in successors[member]:
+                            if component_of[succ] != len(components):
+                                mask |= closures[component_of[succ]]
+                    components.append(members)
+                    closures.append(mask)
+                    
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+                        
+        self._component_of = component_of
+        self._components = components
+        self._closures = closures
+        
+    def __len__(self):
+        return len(self.names)
+        
+    def __contains__(self, name):
+        return name in self._index
+        
+    def _mask(self, names):
+        index = self._index
+        mask = 0
+        for name in names:
+            assert name in index, "unknown package %s" % (name)
+            mask |= 1 << index[name]
+        return mask
+        
+    def _names(self, mask):
+        names = self.names
+        return [names[idx] for idx in _bit_indexes(mask)]
+        
+    def dependencies(self, name):
+        """Returns names of the direct dependencies of a package, with .ARCH expanded."""
+        return [self.names[idx] for idx in self._successors[self._index[name]]]
+        
+    def dependents(self, name):
+        """Returns names of the packages that depend directly on a package."""
+        return [self.names[idx] for idx in self._predecessor_lists()[self._index[name]]]
+        
+    def reverse_dependencies(self):
+        """Returns a dictionary mapping each package name to the names that depend on it directly."""
+        return dict((name, self.dependents(name)) for name in self.names)
+        
+    def cycles(self):
+        """Returns a list of name lists, one for each group of packages that depend on each other."""
+        return [sorted(self.names[idx] for idx in members) for members in self._components if len(members) > 1]
+        
+    def _predecessor_lists(self):
+        if self._predecessors is None:
+            predecessors = [[] for idx in range(len(self.names))]
+            for idx, targets in enumerate(self._successors):
+                for succ in targets:
+                    predecessors[succ].append(idx)
+            self._predecessors = predecessors
+        return self._predecessors
+        
+    def _closure_mask(self, roots, exclude):
+        component_of = self._component_of
+        closures = self._closures
+        root_mask = self._mask(roots)
+        if not exclude:
+            mask = 0
+            for idx in _bit_indexes(root_mask):
+                mask |= closures[component_of[idx]]
+            return mask
+            
+        # Excluded packages are neither installed nor followed.  Only the
+        # packages that can reach an excluded one need to be walked; the
+        # precomputed closure of anything else is still correct.
+        index = self._index
+        excluded = set(index[name] for name in exclude)
+        allowed = ~self._mask(exclude)
+        predecessors = self._predecessor_lists()
+        dirty = set()
+        work = list(excluded)
+        while work:
+            for pred in predecessors[work.pop()]:
+                if pred not in dirty:
+                    dirty.add(pred)
+                    work.append(pred)
+                    
+        leaf_masks = self._leaf_masks
+        inner_successors = self._inner_successors
+        mask = 0
+        visited = set()
+        work = [idx for idx in _bit_indexes(root_mask) if idx not in excluded]
+        while work:
+            idx = work.pop()
+            if idx in visited:
+                continue
+            visited.add(idx)
+            if idx not in dirty:
+                mask |= closures[component_of[idx]]
+                continue
+            # dependencies without dependencies of their own are added at once
+            mask |= (1 << idx) | (leaf_masks[idx] & allowed)
+            for succ in inner_successors[idx]:
+                if succ not in excluded and succ not in visited:
+                    work.append(succ)
+        return mask
+        
+    def closure(self, roots, exclude=()):
+        """Returns names of everything installing roots pulls in, including roots.
+        
+        Arguments:
+        roots -- package names, e.g., ["scheme-full"]
+        exclude -- package names that won't be installed; their dependencies
+        are only included if something else requires them
+        
+        Returns:
+        A list of names in tlpdb order.
+        
+        """
+        return self._names(self._closure_mask(roots, exclude))
+        
+    def closure_size(self, roots, exclude=()):
+        """Returns the number of packages closure() would return, without building the list."""
+        return _bit_count(self._closure_mask(roots, exclude))
+        
+    def required_by(self, name):
+        """Returns names of every package that depends on name, directly or indirectly."""
+        idx = self._index[name]
+        component = self._component_of[idx]
+        mask = 0
+        for other, closure in enumerate(self._closures):
+            if other != component and (closure >> idx) & 1:
+                for member in self._components[other]:
+                    mask |= 1 << member
+        for member in self._components[component]:
+            if member != idx:
+                mask |= 1 << member
+        return self._names(mask)
+        
+if __name__ == '__main__':
+    
+    import os
+    from optparse import OptionParser
+    
+    usage = "usage: %prog [options] package...\n\nPrint the packages required by the named packages, one per line."
+    parser = OptionParser()
+    parser.set_usage(usage)
+    parser.add_option("-t", "--tlpdb", dest="tlpdb_path", help="read the tlpdb from FILE (default is stdin)", metavar="FILE", action="store", type="string")
+    parser.add_option("-a", "--arch", dest="archs", help="expand .ARCH dependencies for ARCH only; may be repeated", metavar="ARCH", action="append")
+    parser.add_option("-x", "--exclude", dest="exclude", help="don't install PACKAGE unless something else requires it; may be repeated", metavar="PACKAGE", action="append", default=[])
+    parser.add_option("-r", "--reverse", dest="reverse", help="print the packages that require the named packages instead", action="store_true", default=False)
+    parser.add_option("-c", "--count", dest="count", help="only print the number of packages", action="store_true", default=False)
+    
+    (options, args) = parser.parse_args(sys.argv[1:])
+    if len(args) == 0:
+        parser.error("no packages specified")
+        
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from parse_tlpdb import packages_from_tlpdb
+    
+    flat_tlpdb = open(options.tlpdb_path, "r") if options.tlpdb_path else sys.stdin
+    all_packages, index_map = packages_from_tlpdb(flat_tlpdb)
+    graph = DependencyGraph(all_packages, options.archs)
+    
+    for name in args + options.exclude:
+        if name not in graph:
+            sys.stderr.write("No package named %s\n" % (name))
+            exit(1)
+            
+    if options.reverse:
+        names = set()
+        for name in args:
+            names.update(graph.required_by(name))
+        names = sorted(names)
+    else:
+        names = graph.closure(args, options.exclude)
+        
+    if options.count:
+        sys.stdout.write("%d\n" % (len(names)))
+    else:
+        for name in names:
+            sys.stdout.write(name + "\n")
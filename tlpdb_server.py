@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+
+#
+# This software is Copyright (c) 2026
+# Adam Maxwell. All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 
+# - Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in
+# the documentation and/or other materials provided with the
+# distribution.
+# 
+# - Neither the name of Adam Maxwell nor the names of any
+# contributors may be used to endorse or promote products derived
+# from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# Resident query server for a parsed tlpdb, so lookups don't pay for Python
+# startup and a full parse every time:
+#
+#   $ ./parse_tlpdb.py serve --socket /tmp/tlpdb.sock /usr/local/texlive/2026/tlpkg/texlive.tlpdb
+#
+# The packages stay in memory, and the tlpdb is checked for changes about once
+# a second; only new and changed records are parsed again when it changes.
+# Clients connect to the Unix domain socket and send any number of requests on
+# one connection.  Each request and response is a 4-byte big-endian length
+# followed by that many bytes of UTF-8 JSON.  Requests are objects with a
+# "query" key:
+#
+#   {"query" : "name", "name" : "latex"}  -> package dictionary, or null
+#   {"query" : "category", "category" : "Collection"}  -> list of package names
+#   {"query" : "owner", "path" : "texmf-dist/tex/latex/base/latex.ltx"}  -> list of package names
+#   {"query" : "dump"}  -> {"mirror" : ..., "packages" : [package dictionaries]}
+#   {"query" : "status"}  -> {"path" : ..., "packages" : count, "generation" : reload count}
+#
+# "name" and "dump" take an optional "fields" list, as for parse_tlpdb.py
+# --fields.  Package dictionaries have the same keys as in the property list.
+# Responses are {"result" : value} or {"error" : message}.
+
+import os
+import sys
+import struct
+import json
+
+from parse_tlpdb import TLDatabase, PACKAGE_FIELDS, FileOwnerIndex, open_tlpdb, update_packages_from_tlpdb
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+_LENGTH = struct.Struct(">I")
+
+# requests are small; anything bigger is a confused or hostile client
+MAX_REQUEST_SIZE = 1024 * 1024
+
+class QueryError(Exception):
+    """An error response from the server."""
+    pass
+    
+def _recv_exactly(sock, count):
+    """Returns count bytes from sock, or None if the connection was closed before the first one."""
+    chunks = []
+    remaining = count
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            if remaining == count:
+                return None
+            raise EOFError("connection closed in the middle of a message")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+    
+def _send_message(sock, value):
+    data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+    
+def _receive_data(sock, max_size=None):
+    """Returns the bytes of the next message from sock, or None at the end of the connection."""
+    header = _recv_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    size = _LENGTH.unpack(header)[0]
+    if max_size is not None and size > max_size:
+        raise ValueError("message of %d bytes is too large" % (size))
+    data = _recv_exactly(sock, size) if size else b""
+    if data is None:
+        raise EOFError("connection closed in the middle of a message")
+    return data
+    
+def _receive_message(sock, max_size=None):
+    """Returns the next decoded message from sock, or None at the end of the connection."""
+    data = _receive_data(sock, max_size)
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+    
+def query(socket_path, request, timeout=None):
+    """Sends one request to a server and returns the result.
+    
+    Arguments:
+    socket_path -- path of the server's Unix domain socket
+    request -- a request dictionary, e.g., {"query" : "name", "name" : "latex"}
+    timeout -- seconds to wait for the server, or None to wait indefinitely
+    
+    Returns:
+    The decoded result.  Raises QueryError if the server returned an error.
+    
+    Open a socket and use send_query for many queries; a new connection for
+    each one is cheap, but not free.
+    
+    """
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        return send_query(sock, request)
+    finally:
+        sock.close()
+        
+def send_query(sock, request):
+    """Sends a request on a connected socket and returns the result; see query."""
+    _send_message(sock, request)
+    response = _receive_message(sock)
+    if response is None:
+        raise EOFError("server closed the connection")
+    if "error" in response:
+        raise QueryError(response["error"])
+    return response["result"]
+    
+class _LoadedDatabase(TLDatabase):
+    """Packages from one load of the tlpdb, with the indexes used by queries.
+    
+    Never modified after it's built, so request threads can use it without
+    locking while a reload builds its replacement.
+    
+    """
+    
+    def __init__(self, packages, mirror, generation):
+        super(_LoadedDatabase, self).__init__(packages, mirror)
+        self.generation = generation
+        self.file_index = FileOwnerIndex()
+        for package in self.packages:
+            self.file_index.add_package(package)
+            
+class TLPDBServer(object):
+    """Keeps a parsed tlpdb in memory and answers queries about it.
+    
+    Arguments:
+    tlpdb_path -- path of the tlpdb to load; may be compressed
+    allow_partial -- Pass True to keep whatever was parsed before an error
+    
+    handle_request works without a socket, so this can also be used in
+    process; serve_forever listens on a Unix domain socket.
+    
+    """
+    
+    def __init__(self, tlpdb_path, allow_partial=False):
+        super(TLPDBServer, self).__init__()
+        self.tlpdb_path = os.path.abspath(tlpdb_path)
+        self.allow_partial = allow_partial
+        self.database = None
+        # identity of the file at the last load, or the last failed attempt
+        self._identity_checked = None
+        self.reload()
+        
+    def _identity(self):
+        info = os.stat(self.tlpdb_path)
+        return (info.st_ino, info.st_size, info.st_mtime)
+        
+    def reload(self):
+        """Parses the tlpdb again if it changed since the last load.
+        
+        Returns:
+        True if the packages were reloaded.  If the parse fails, the previous
+        packages are kept and the error is written to stderr, unless there
+        were no previous packages.
+        
+        """
+        identity = self._identity()
+        if identity == self._identity_checked:
+            return False
+        self._identity_checked = identity
+        database = self.database
+        previous_packages = database.packages if database is not None else []
+        try:
+            with open_tlpdb(self.tlpdb_path) as flat_tlpdb:
+                packages, index_map, delta, mirror = update_packages_from_tlpdb(flat_tlpdb, previous_packages, self.allow_partial)
+        except Exception as e:
+            if database is None:
+                raise
+            # e.g., caught in the middle of being rewritten; tried again once it changes
+            sys.stderr.write("keeping the previous packages; failed to reload %s: %s\n" % (self.tlpdb_path, e))
+            return False
+        generation = database.generation + 1 if database is not None else 0
+        self.database = _LoadedDatabase(packages, mirror, generation)
+        return True
+        
+    def handle_request(self, request):
+        """Returns the result for a decoded request; raises ValueError for a bad one."""
+        if not isinstance(request, dict) or "query" not in request:
+            raise ValueError("request must be an object with a query key")
+        database = self.database
+        kind = request["query"]
+        fields = request.get("fields")
+        if fields is not None:
+            if not isinstance(fields, list) or [field for field in fields if field not in PACKAGE_FIELDS]:
+                raise ValueError("fields must be a list of %s" % (", ".join(PACKAGE_FIELDS)))
+        if kind == "name":
+            package = database.get(request.get("name"))
+            return None if package is None else package.dictionary_value(fields)
+        if kind == "category":
+            return [package.name for package in database.packages_in_category(request.get("category"))]
+        if kind == "owner":
+            path = request.get("path")
+            if not isinstance(path, type(u"")):
+                raise ValueError("owner query needs a path")
+            return database.file_index.owners(path)
+        if kind == "dump":
+            return {"mirror" : database.mirror, "packages" : [package.dictionary_value(fields) for package in database.packages]}
+        if kind == "status":
+            return {"path" : self.tlpdb_path, "packages" : len(database.packages), "generation" : database.generation}
+        raise ValueError("unknown query %s" % (kind))
+        
+    def serve_forever(self, socket_path, check_interval=1.0):
+        """Answers requests on a Unix domain socket until SIGTERM or SIGINT.
+        
+        Arguments:
+        socket_path -- path to create the socket at; a stale socket left by a
+        server that's no longer running is replaced
+        check_interval -- seconds between checks for changes to the tlpdb
+        
+        The socket is only accessible to this user.  Each connection is served
+        on its own thread; reloads happen on the listening thread.
+        
+        """
+        import signal
+        import socket
+        
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except socket.error as e:
+                os.remove(socket_path)
+            else:
+                probe.close()
+                raise RuntimeError("a server is already listening on %s" % (socket_path))
+                
+        server = self
+        
+        class _RequestHandler(socketserver.BaseRequestHandler):
+            
+            def handle(self):
+                while True:
+                    try:
+                        data = _receive_data(self.request, MAX_REQUEST_SIZE)
+                    except (ValueError, EOFError) as e:
+                        # can't tell where the next message starts
+                        _send_message(self.request, {"error" : str(e)})
+                        return
+                    if data is None:
+                        return
+                    try:
+                        # the whole message was read, so one that isn't JSON
+                        # gets an error like any other bad request
+                        request = json.loads(data.decode("utf-8"))
+                        response = {"result" : server.handle_request(request)}
+                    except ValueError as e:
+                        response = {"error" : str(e)}
+                    except Exception as e:
+                        # e.g., a list where a name should be; the connection is still usable
+                        response = {"error" : "%s: %s" % (type(e).__name__, e)}
+                    _send_message(self.request, response)
+                    
+        class _SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+            
+            def service_actions(self):
+                # called by serve_forever every poll_interval
+                try:
+                    server.reload()
+                except Exception as e:
+                    sys.stderr.write("failed to check %s: %s\n" % (server.tlpdb_path, e))
+                    
+        def _terminate(signum, frame):
+            raise SystemExit(0)
+            
+        old_umask = os.umask(0o077)
+        try:
+            listener = _SocketServer(socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        signal.signal(signal.SIGTERM, _terminate)
+        try:
+            listener.serve_forever(poll_interval=check_interval)
+        except KeyboardInterrupt as e:
+            pass
+        finally:
+            listener.server_close()
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+                
+def main(argv):
+    """Command line entry point for parse_tlpdb.py serve."""
+    from optparse import OptionParser
+    
+    usage = "usage: %prog serve [options] tlpdb_path\n\nKeep the parsed tlpdb in memory and answer queries on a Unix domain socket."
+    parser = OptionParser()
+    parser.set_usage(usage)
+    parser.add_option("-s", "--socket", dest="socket_path", help="listen on a Unix domain socket at PATH", metavar="PATH", action="store", type="string")
+    parser.add_option("-p", "--partial", dest="allow_partial", help="read file contents until an error occurs and return partial data", action="store_true", default=False)
+    parser.add_option("-i", "--interval", dest="check_interval", help="check the tlpdb for changes every SECONDS (default 1)", metavar="SECONDS", action="store", type="float", default=1.0)
+    
+    (options, args) = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error("a tlpdb path is required")
+    if not options.socket_path:
+        parser.error("a socket path is required")
+        
+    server = TLPDBServer(args[0], options.allow_partial)
+    try:
+        server.serve_forever(options.socket_path, options.check_interval)
+    except RuntimeError as e:
+        sys.stderr.write("%s\n" % (e))
+        return 1
+    return 0
+    
+if __name__ == '__main__':
+    
+    exit(main(sys.argv[1:]))